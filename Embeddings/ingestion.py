@@ -0,0 +1,446 @@
+"""
+Streaming ingestion helpers for the upload scripts: read a TSV in chunks,
+embed in batches (optionally on a process pool), insert into Milvus in bounded
+batches and checkpoint progress so an interrupted upload can resume. Memory
+stays proportional to the chunk size, not the file size.
+
+Every row is stored with a hash of its embedded text and of the whole row, so
+an upload can also sync an existing collection (only changed rows are
+re-embedded) or build a shadow collection and swap it in behind an alias.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pymilvus import Collection, utility
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared_resources import get_sentence_model, EMBEDDING_MODEL_ID
+from embedding_store import EmbeddingStore
+
+# Rows read from the TSV at a time
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+# Texts per model.encode call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Rows per collection.insert call
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "1000"))
+# Embedding processes; 0 embeds in the uploading process
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+# Reuse vectors from the on-disk embedding store (embedding_store.py) for text embedded before
+USE_EMBEDDING_STORE = os.getenv("USE_EMBEDDING_STORE", "true").lower() == "true"
+PROGRESS_INTERVAL = 10  # seconds between progress lines
+
+# Stored with every row, before the vector, so a sync can tell what changed
+HASH_FIELDS = ['text_hash', 'row_hash']
+HASH_LENGTH = 64
+
+_worker_model = None
+
+
+def _init_worker():
+    # One thread per process: the pool supplies the parallelism
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    os.environ.setdefault("ONNX_NUM_THREADS", "1")
+    global _worker_model
+    _worker_model = get_sentence_model()
+
+
+def _encode_batch(texts):
+    return np.asarray(_worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True), dtype=np.float32)
+
+
+class Embedder:
+    """
+    Encodes lists of texts in EMBED_BATCH_SIZE batches, on a background thread or
+    on a pool of worker processes, so the caller can insert while they encode.
+    With the embedding store, only texts it does not have are encoded,
+    and their vectors are added to it.
+    """
+
+    def __init__(self, workers=EMBED_WORKERS, batch_size=EMBED_BATCH_SIZE, use_store=USE_EMBEDDING_STORE):
+        self.batch_size = batch_size
+        self.store = EmbeddingStore() if use_store else None
+        self.pool = None
+        self.thread = None
+        self.model = None
+        if workers > 0:
+            # spawn: forking a process that has loaded torch can deadlock
+            self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+        else:
+            # One thread is enough to overlap with inserts: torch releases the GIL while it encodes
+            self.thread = ThreadPoolExecutor(1, thread_name_prefix="embed")
+
+    def submit(self, texts):
+        """Starts encoding texts; returns a callable that waits for the float32 matrix."""
+        if self.store is None:
+            return self._submit(texts)
+        rows = self.store.lookup(texts)
+        missing = list(dict.fromkeys(text for text, row in zip(texts, rows) if row < 0))
+        self.store.hits += len(texts) - int((rows < 0).sum())
+        self.store.misses += len(missing)
+        pending = self._submit(missing)
+
+        def result():
+            if missing:
+                self.store.add(missing, pending())
+            return np.array(self.store.matrix(self.store.lookup(texts)))
+        return result
+
+    def _submit(self, texts):
+        # The in-process model is loaded on first use: a re-run may find every vector in the store
+        if self.pool is None and self.model is None and texts:
+            self.model = get_sentence_model()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.pool is None:
+            return self.thread.submit(self._encode_in_process, batches).result
+        futures = [self.pool.submit(_encode_batch, batch) for batch in batches]
+        return lambda: self._join([future.result() for future in futures])
+
+    def encode(self, texts):
+        return self.submit(texts)()
+
+    def _encode_in_process(self, batches):
+        return self._join([np.asarray(self.model.encode(batch, batch_size=self.batch_size, convert_to_numpy=True), dtype=np.float32) for batch in batches])
+
+    @staticmethod
+    def _join(parts):
+        return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.thread is not None:
+            self.thread.shutdown()
+        if self.store is not None:
+            print(f"Embedding store: {self.store.hits} texts reused, {self.store.misses} embedded")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_columns(path):
+    return list(pd.read_csv(path, sep='\t', nrows=0).columns)
+
+
+def count_rows(path):
+    with open(path, 'rb') as file:
+        return max(sum(1 for _ in file) - 1, 0)
+
+
+def read_tsv_chunks(path, chunk_rows=INGEST_CHUNK_ROWS, start_row=0):
+    """Yields (offset of the chunk's first row, DataFrame) with every value read as a string."""
+    reader = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False, chunksize=chunk_rows,
+                         skiprows=range(1, start_row + 1))
+    offset = start_row
+    for chunk in reader:
+        yield offset, chunk
+        offset += len(chunk)
+
+
+class Checkpoint:
+    """
+    Number of rows of a TSV already inserted for a collection, and the collection
+    they went into (a shadow collection while one is being built), kept next to the TSV.
+    """
+
+    def __init__(self, tsv_path, collection_name):
+        self.path = f"{tsv_path}.{collection_name}.checkpoint"
+        self.target = collection_name
+        # True when target is a shadow collection to swap in once it is complete
+        self.shadow = False
+
+    def load(self):
+        """Returns (rows, target collection, shadow), or (0, None, False) when there is nothing to resume."""
+        if not os.path.exists(self.path):
+            return 0, None, False
+        with open(self.path) as file:
+            state = json.load(file)
+        return state.get("rows", 0), state.get("target"), state.get("shadow", False)
+
+    def save(self, rows):
+        with open(self.path + ".tmp", 'w') as file:
+            json.dump({"rows": rows, "target": self.target, "shadow": self.shadow, "updated": time.time()}, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.started_at = done
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def update(self, rows, force=False):
+        self.done += rows
+        now = time.monotonic()
+        if not force and now - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        rate = (self.done - self.started_at) / max(now - self.start, 1e-9)
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        print(f"{self.done}/{self.total} rows ({rate:.0f} rows/s, about {eta:.0f}s left)")
+
+
+def text_hash(text):
+    # Includes the model, so switching EMBEDDING_BACKEND re-embeds every row on the next sync
+    return hashlib.sha256(f"{EMBEDDING_MODEL_ID}\0{text}".encode("utf-8")).hexdigest()
+
+
+def add_hashes(columns, texts):
+    """Adds the text_hash and row_hash columns to a dict of scalar columns."""
+    names = list(columns)
+    columns['text_hash'] = [text_hash(text) for text in texts]
+    columns['row_hash'] = [
+        hashlib.sha256(json.dumps([digest] + [columns[name][i] for name in names]).encode("utf-8")).hexdigest()
+        for i, digest in enumerate(columns['text_hash'])
+    ]
+    return columns
+
+
+def select_rows(columns, indices):
+    return {name: [values[i] for i in indices] for name, values in columns.items()}
+
+
+def insert_in_batches(collection, columns, batch_size=INSERT_BATCH_SIZE, on_batch=None):
+    """Inserts a dict of equal-length column lists in batches of at most batch_size rows."""
+    names = list(columns)
+    rows = len(columns[names[0]]) if names else 0
+    for start in range(0, rows, batch_size):
+        collection.insert([columns[name][start:start + batch_size] for name in names])
+        if on_batch:
+            on_batch(min(batch_size, rows - start))
+
+
+def stream_upload(path, collection, text_column, fields, embedder, checkpoint, start_row=0,
+                  chunk_rows=INGEST_CHUNK_ROWS, insert_batch_size=INSERT_BATCH_SIZE):
+    """
+    Uploads the TSV at path from start_row on. fields(chunk) returns the scalar
+    columns to insert for a chunk; the text_column of each row is embedded into
+    'vector' and hashed into HASH_FIELDS. The next chunk is already being embedded while the current one is
+    inserted. Progress is checkpointed after every insert batch.
+    """
+    progress = Progress(count_rows(path), start_row)
+    inserted = start_row
+
+    def on_batch(rows):
+        nonlocal inserted
+        inserted += rows
+        checkpoint.save(inserted)
+        progress.update(rows)
+
+    pending = None
+    for _, chunk in read_tsv_chunks(path, chunk_rows, start_row):
+        encoding = embedder.submit(chunk[text_column].tolist())
+        if pending:
+            _insert_chunk(collection, *pending, text_column, fields, insert_batch_size, on_batch)
+        pending = (chunk, encoding)
+    if pending:
+        _insert_chunk(collection, *pending, text_column, fields, insert_batch_size, on_batch)
+    progress.update(0, force=True)
+    return inserted
+
+
+def _insert_chunk(collection, chunk, encoding, text_column, fields, insert_batch_size, on_batch):
+    columns = add_hashes(fields(chunk), chunk[text_column].tolist())
+    columns['vector'] = encoding().tolist()
+    insert_in_batches(collection, columns, insert_batch_size, on_batch)
+
+
+def existing_rows(collection, key_field, batch_size=INSERT_BATCH_SIZE):
+    """
+    Reads key -> (primary key, text_hash, row_hash) for every row of the
+    collection, plus the primary keys of extra rows with an already seen key.
+    """
+    rows, duplicates = {}, []
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=[key_field] + HASH_FIELDS)
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        for row in batch:
+            if row[key_field] in rows:
+                duplicates.append(row['id'])
+            else:
+                rows[row[key_field]] = (row['id'], row['text_hash'], row['row_hash'])
+    return rows, duplicates
+
+
+def stored_vectors(collection, ids):
+    if not ids:
+        return {}
+    return {row['id']: row['vector'] for row in collection.query(expr=f"id in {list(ids)}", output_fields=['vector'])}
+
+
+def delete_ids(collection, ids, batch_size=INSERT_BATCH_SIZE):
+    for start in range(0, len(ids), batch_size):
+        collection.delete(expr=f"id in {ids[start:start + batch_size]}")
+
+
+def sync_upload(path, collection, key_field, text_column, fields, embedder,
+                chunk_rows=INGEST_CHUNK_ROWS, insert_batch_size=INSERT_BATCH_SIZE):
+    """
+    Brings an existing collection in line with the TSV without emptying it:
+    new rows are inserted, rows whose embedded text changed are re-embedded,
+    rows where only other fields changed keep their stored vector, and rows no
+    longer in the TSV are deleted. A changed row's new version is inserted
+    before its old one is deleted, so it is never missing from search.
+    Safe to re-run after an interruption. Returns counts per kind of change.
+    """
+    existing, duplicates = existing_rows(collection, key_field)
+    print(f"{len(existing)} rows in '{collection.name}'")
+    counts = {"added": 0, "reembedded": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    progress = Progress(count_rows(path))
+    seen = set()
+
+    for _, chunk in read_tsv_chunks(path, chunk_rows):
+        texts = chunk[text_column].tolist()
+        columns = add_hashes(fields(chunk), texts)
+        embed, reuse, stale = [], [], []
+        for i, key in enumerate(columns[key_field]):
+            seen.add(key)
+            old = existing.get(key)
+            if old is None:
+                embed.append(i)
+                counts["added"] += 1
+            elif old[2] == columns['row_hash'][i]:
+                counts["unchanged"] += 1
+            else:
+                stale.append(old[0])
+                if old[1] == columns['text_hash'][i]:
+                    reuse.append((i, old[0]))
+                    counts["updated"] += 1
+                else:
+                    embed.append(i)
+                    counts["reembedded"] += 1
+
+        if embed or reuse:
+            vectors = stored_vectors(collection, [old_id for _, old_id in reuse])
+            changed = select_rows(columns, embed + [i for i, _ in reuse])
+            changed['vector'] = embedder.encode([texts[i] for i in embed]).tolist() + [list(vectors[old_id]) for _, old_id in reuse]
+            insert_in_batches(collection, changed, insert_batch_size)
+        delete_ids(collection, stale, insert_batch_size)
+        progress.update(len(chunk))
+
+    removed = [old[0] for key, old in existing.items() if key not in seen] + duplicates
+    delete_ids(collection, removed, insert_batch_size)
+    counts["deleted"] = len(removed)
+    progress.update(0, force=True)
+    return counts
+
+
+def collection_behind_alias(alias):
+    for name in utility.list_collections():
+        if alias in utility.list_aliases(name):
+            return name
+    return None
+
+
+def resolve_collection(name):
+    """The collection name refers to, directly or as an alias, or None if there is none."""
+    target = collection_behind_alias(name)
+    if target is None and utility.has_collection(name):
+        target = name
+    return target
+
+
+def drop_collection_or_alias(name):
+    target = collection_behind_alias(name)
+    if target is not None:
+        utility.drop_alias(name)
+        utility.drop_collection(target)
+    elif utility.has_collection(name):
+        utility.drop_collection(name)
+
+
+def swap_alias(alias, new_collection):
+    """Points alias at new_collection, then drops the collection it replaced."""
+    old = collection_behind_alias(alias)
+    if old == new_collection:
+        return
+    if old is not None:
+        utility.alter_alias(collection_name=new_collection, alias=alias)
+        utility.drop_collection(old)
+        return
+    if utility.has_collection(alias):
+        # A collection by that name predates aliases; it has to go before the alias can be created
+        print(f"Replacing collection '{alias}' with an alias; searches fail until the alias exists.")
+        utility.drop_collection(alias)
+    utility.create_alias(collection_name=new_collection, alias=alias)
+
+
+def add_upload_arguments(parser):
+    parser.add_argument("--rebuild", action="store_true", help="drop the collection and upload everything again")
+    parser.add_argument("--shadow", action="store_true",
+                        help="upload everything into a new collection and swap it in behind the collection name")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted full upload from its checkpoint")
+    parser.add_argument("--start-row", type=int, help="continue a full upload from this TSV row instead of the checkpoint")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="embedding processes (0 embeds in this process)")
+
+
+def upload(args, collection_name, tsv_path, key_field, text_column, fields, create_collection):
+    """
+    Runs an upload script. By default an existing collection is synced in place
+    (sync_upload); a missing one is created and filled. --rebuild drops and
+    refills it, --shadow fills a new collection and swaps it in behind
+    collection_name as an alias. create_collection(name) must create the
+    collection with its vector index.
+    """
+    checkpoint = Checkpoint(tsv_path, collection_name)
+    target = resolve_collection(collection_name)
+    resuming = args.resume or args.start_row is not None
+    shadow = args.shadow
+
+    with Embedder(workers=args.workers) as embedder:
+        if resuming:
+            rows, saved_target, checkpoint.shadow = checkpoint.load()
+            start_row = args.start_row if args.start_row is not None else rows
+            # Without a checkpoint, continue into whatever collection_name refers to now
+            checkpoint.target = saved_target or target
+            if checkpoint.target is None or not utility.has_collection(checkpoint.target):
+                raise SystemExit(f"Cannot resume: collection '{checkpoint.target or collection_name}' does not exist")
+            print(f"Resuming upload into '{checkpoint.target}' from row {start_row}.")
+        else:
+            if target is not None and not (args.rebuild or shadow):
+                collection = Collection(name=target)
+                if set(HASH_FIELDS) <= {field.name for field in collection.schema.fields}:
+                    collection.load()
+                    counts = sync_upload(tsv_path, collection, key_field, text_column, fields, embedder)
+                    collection.flush()
+                    print(f"Collection '{collection_name}' synced: " + ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+                    return
+                print(f"Collection '{collection_name}' has no row hashes; building a replacement instead.")
+                shadow = True
+
+            start_row = 0
+            if shadow and target is not None:
+                checkpoint.target = f"{collection_name}_{time.strftime('%Y%m%d%H%M%S')}"
+                checkpoint.shadow = True
+            else:
+                drop_collection_or_alias(collection_name)
+            create_collection(checkpoint.target)
+            print(f"Collection '{checkpoint.target}' created.")
+
+        collection = Collection(name=checkpoint.target)
+        collection.load()
+        rows = stream_upload(tsv_path, collection, text_column, fields, embedder, checkpoint, start_row=start_row)
+        collection.flush()
+
+    if checkpoint.shadow:
+        swap_alias(collection_name, checkpoint.target)
+        print(f"'{collection_name}' now points to '{checkpoint.target}'.")
+    checkpoint.clear()
+    print(f"Data uploaded successfully ({rows} rows).")
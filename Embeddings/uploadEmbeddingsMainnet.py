@@ -1,9 +1,11 @@
 import os
-import pandas as pd
-from pymilvus import connections, DataType, FieldSchema, CollectionSchema, Collection, utility
-from sentence_transformers import SentenceTransformer
+import argparse
+from pymilvus import connections, DataType, FieldSchema, CollectionSchema, Collection
 from dotenv import load_dotenv
 
+# Embed with the same backend (EMBEDDING_BACKEND) as the server so stored and query vectors match
+from ingestion import HASH_FIELDS, HASH_LENGTH, add_upload_arguments, read_columns, upload
+
 # Load environment variables
 load_dotenv()
 
@@ -11,64 +13,47 @@ load_dotenv()
 uri = os.getenv("MILVUS_URI_MAINNET")
 token = os.getenv("MILVUS_TOKEN_MAINNET")
 collection_name = 'EntityCollection'
+tsv_path = 'entitiesMainnet.tsv'
 DIMENSION = 384  # Dimension of embeddings
 
-# Connect to Milvus
-connections.connect(uri=uri, token=token, secure=True)
-
-# Define the embedding model
-embedding_model = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
-model = SentenceTransformer(embedding_model)
-
-def create_collection_schema(df, collection_name):
+def create_collection_schema(columns, collection_name):
     fields = [FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True)]
-    for col in df.columns:
+    for col in columns:
         if col != 'NER':  # Exclude 'NER' field
             fields.append(FieldSchema(name=col, dtype=DataType.VARCHAR, max_length=65535))
+    for name in HASH_FIELDS:
+        fields.append(FieldSchema(name=name, dtype=DataType.VARCHAR, max_length=HASH_LENGTH))
     fields.append(FieldSchema(name='vector', dtype=DataType.FLOAT_VECTOR, dim=DIMENSION))  # Embedding column
     schema = CollectionSchema(fields)
     collection = Collection(name=collection_name, schema=schema)
     return collection
 
-def tokenize_and_embed(text):
-    encoded_input = model.encode(text, convert_to_tensor=True)
-    return encoded_input.cpu().numpy().tolist()
+def create_collection(name):
+    collection = create_collection_schema(read_columns(tsv_path), name)
 
-# Read TSV
-df = pd.read_csv('entitiesMainnet.tsv', sep='\t')
+    # Indexing parameters
+    index_params = {
+        'metric_type': 'L2',
+        'index_type': 'AUTOINDEX',
+        'params': {}
+    }
 
-# Check if the collection already exists
-if utility.has_collection(collection_name):
-    collection = Collection(name=collection_name)
-    print(f"Collection '{collection_name}' already exists. Dropping it.")
-    utility.drop_collection(collection_name)
-
-# Create the collection since it either doesn't exist or was just dropped
-collection = create_collection_schema(df, collection_name)
-print(f"Collection '{collection_name}' created.")
-
-# Indexing parameters
-index_params = {
-    'metric_type': 'L2',
-    'index_type': 'AUTOINDEX',
-    'params': {}
-}
+    collection.create_index(field_name='vector', index_params=index_params)
+    return collection
 
-# Create index and load collection
-collection.create_index(field_name='vector', index_params=index_params)
-collection.load()
+def entity_fields(chunk):
+    return {col: chunk[col].tolist() for col in chunk.columns if col != 'NER'}
 
-# Prepare and insert data into Milvus
-insert_data = {col: [] for col in df.columns if col != 'NER'}
-insert_data['vector'] = []
+def main():
+    parser = argparse.ArgumentParser(description="Upload entity embeddings to Milvus")
+    add_upload_arguments(parser)
+    args = parser.parse_args()
 
-for _, row in df.iterrows():
-    for col in df.columns:
-        if col != 'NER':
-            insert_data[col].append(row[col])
-    insert_data['vector'].append(tokenize_and_embed(row['NER']))
+    # Connect to Milvus
+    connections.connect(uri=uri, token=token, secure=True)
 
-# Insert data
-collection.insert([insert_data[col] for col in insert_data])
+    # Rows are keyed on EntityID; the NER text is what gets embedded
+    upload(args, collection_name, tsv_path, 'EntityID', 'NER', entity_fields, create_collection)
 
-print("Data uploaded successfully.")
+if __name__ == "__main__":
+    main()
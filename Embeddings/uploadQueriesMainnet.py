@@ -1,9 +1,11 @@
 import os
-import pandas as pd
-from pymilvus import connections, DataType, FieldSchema, CollectionSchema, Collection, utility
-from sentence_transformers import SentenceTransformer
+import argparse
+from pymilvus import connections, DataType, FieldSchema, CollectionSchema, Collection
 from dotenv import load_dotenv
 
+# Embed with the same backend (EMBEDDING_BACKEND) as the server so stored and query vectors match
+from ingestion import HASH_FIELDS, HASH_LENGTH, add_upload_arguments, upload
+
 # Load environment variables
 load_dotenv()
 
@@ -11,54 +13,45 @@ load_dotenv()
 uri = os.getenv("MILVUS_URI_MAINNET")
 token = os.getenv("MILVUS_TOKEN_MAINNET")
 collection_name = 'QueryCollection'
+tsv_path = 'queriesMainnet.tsv'
 DIMENSION = 384  # Dimension of embeddings
 
-# Connect to Milvus
-connections.connect(uri=uri, token=token, secure=True)
-utility.drop_collection("QueryCollection")
-
-# Define the embedding model
-embedding_model = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
-model = SentenceTransformer(embedding_model)
-
-def create_collection_schema(df, collection_name):
+def create_collection_schema(collection_name):
     fields = [FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True)]
-    for col in df.columns:
-        if col == 'combined':  # The new combined column
-            fields.append(FieldSchema(name=col, dtype=DataType.VARCHAR, max_length=65535))
+    fields.append(FieldSchema(name='combined', dtype=DataType.VARCHAR, max_length=65535))
+    for name in HASH_FIELDS:
+        fields.append(FieldSchema(name=name, dtype=DataType.VARCHAR, max_length=HASH_LENGTH))
     fields.append(FieldSchema(name='vector', dtype=DataType.FLOAT_VECTOR, dim=DIMENSION))  # Embedding column
     schema = CollectionSchema(fields=fields)
     collection = Collection(name=collection_name, schema=schema)
     return collection
 
-def tokenize_and_embed(text):
-    encoded_input = model.encode(text, convert_to_tensor=True)
-    return encoded_input.cpu().numpy().tolist()
+def create_collection(name):
+    collection = create_collection_schema(name)
 
-# Read TSV and modify the dataframe
-df = pd.read_csv('queriesMainnet.tsv', sep='\t')
-df['combined'] = df.apply(lambda row: f"question: {row['question']}; query: {row['query']}", axis=1)
+    # Indexing parameters
+    index_params = {
+        'metric_type': 'L2',
+        'index_type': 'AUTOINDEX',
+        'params': {}
+    }
 
-collection = create_collection_schema(df, collection_name)
-
-# Indexing parameters
-index_params = {
-    'metric_type': 'L2',
-    'index_type': 'AUTOINDEX',
-    'params': {}
-}
+    collection.create_index(field_name='vector', index_params=index_params)
+    return collection
 
-collection.create_index(field_name='vector', index_params=index_params)
-collection.load()
+def query_fields(chunk):
+    return {'combined': [f"question: {question}; query: {query}" for question, query in zip(chunk['question'], chunk['query'])]}
 
-# Prepare and insert data into Milvus
-insert_data = {col: [] for col in df.columns if col == 'combined'}
-insert_data['vector'] = []
+def main():
+    parser = argparse.ArgumentParser(description="Upload query embeddings to Milvus")
+    add_upload_arguments(parser)
+    args = parser.parse_args()
 
-for _, row in df.iterrows():
-    insert_data['combined'].append(row['combined'])
-    insert_data['vector'].append(tokenize_and_embed(row['query']))
+    # Connect to Milvus
+    connections.connect(uri=uri, token=token, secure=True)
 
-collection.insert([insert_data[col] for col in insert_data])
+    # Rows are keyed on the combined question and query; the SPARQL query is what gets embedded
+    upload(args, collection_name, tsv_path, 'combined', 'query', query_fields, create_collection)
 
-print("Data uploaded successfully.")
+if __name__ == "__main__":
+    main()
@@ -1,230 +1,279 @@
 import time
 start_time = time.time()
 import os
+import re
+import ast
 import json
 import asyncio
-import concurrent.futures
+import inspect
 from typing import Dict, Any
-from openai import OpenAI
-from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-from pymilvus import MilvusClient
+from contextlib import AsyncExitStack
 from pprint import pprint
-from dkg import DKG
-from dkg.providers import BlockchainProvider, NodeHTTPProvider
+from shared_resources import get_async_openai_client
+from embedding_service import embedding_service
+from ontology_registry import ontology_registry
+from dkg_client import execute_sparql_query_async
+from semantic_cache import semantic_cache, SEMANTIC_CACHE_ENABLED
+from streaming import JSONStringFieldStreamer
+from prompt_builder import build_prompt_inputs, estimate_tokens
+from concurrency import Overloaded, retry_async, upstream_slot, openai_quota
+from sparql_cache import normalize_query
+from metrics import span, timed_function
+from retrieval import search_all, ENTITY_COLLECTION, QUERY_COLLECTION, SEARCH_CONFIG
+from reranker import rerank, RERANK_ENABLED, RERANK_CANDIDATES
+from keyword_index import hybrid_entity_hits, HYBRID_SEARCH_ENABLED
 print(f"importing libraries took {time.time() - start_time:.2f} seconds.")
 start_time = time.time()
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+# Expected completion size, counted against the OpenAI tokens-per-minute quota before the call
+CLASSIFICATION_COMPLETION_TOKENS = 700
 
-def timed_function(func):
-    """Decorator to measure execution time of a function."""
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"{func.__name__} took {end_time - start_time:.2f} seconds.")
-        return result
-    return wrapper
+# Deadline (seconds) for the whole classification call, including a streamed response
+CLASSIFICATION_TIMEOUT = float(os.getenv("CLASSIFICATION_TIMEOUT", "45"))
 
-# Milvus Client Initialization
-CLUSTER_ENDPOINT = os.getenv("MILVUS_URI_MAINNET")
-TOKEN = os.getenv("MILVUS_TOKEN_MAINNET")
-milvus_client = MilvusClient(uri=CLUSTER_ENDPOINT, token=TOKEN)
+# Speculative SPARQL: when the closest QueryCollection match is within this L2 distance,
+# its stored query runs against the DKG while GPT-4 is still answering
+SPECULATIVE_SPARQL_ENABLED = os.getenv("SPECULATIVE_SPARQL_ENABLED", "false").lower() == "true"
+SPECULATIVE_SPARQL_MAX_DISTANCE = float(os.getenv("SPECULATIVE_SPARQL_MAX_DISTANCE", "0.5"))
+# Seconds to wait for GPT-4 before answering with the speculative results alone
+SPECULATIVE_LLM_TIMEOUT = float(os.getenv("SPECULATIVE_LLM_TIMEOUT", "20"))
 
-# Initialize the Sentence Transformer model
-MODEL_NAME = 'sentence-transformers/multi-qa-MiniLM-L6-cos-v1'
-sentence_model = SentenceTransformer(MODEL_NAME)
+def prepend_ontology_prefixes(query, sparql_prefixes):
+    # Prepending the precomputed ontology prefixes to the query
+    return sparql_prefixes + "\n" + query
 
-# Function to convert a list of strings to embeddings
-def convert_to_embeddings(strings):
-    return sentence_model.encode(strings, convert_to_tensor=True).numpy().tolist()
 
-@timed_function
-def prepend_ontology_prefixes(query, ontology_content):
-    # Extracting prefixes from the ontology content
-    prefixes = extract_prefixes(ontology_content)
-
-    # Prepending extracted prefixes to the query
-    amended_query = prefixes + "\n" + query
-    return amended_query
-
-@timed_function
-def extract_prefixes(ontology_content):
-    # Extract prefixes like '@prefix schema: <http://schema.org/> .'
-    lines = ontology_content.split("\n")
-    prefix_lines = [line for line in lines if line.startswith("@prefix")]
-    sparl_prefixes = []
+def stored_sparql(query_hit):
+    # QueryCollection rows are "question: <question>; query: <SPARQL>"
+    combined = query_hit.get("combined") or ""
+    marker = "; query: "
+    return combined.split(marker, 1)[1].strip() if marker in combined else ""
 
-    for line in prefix_lines:
-        # Remove the '.' at the end and split
-        parts = line.rstrip('.').split()
-        if len(parts) >= 3:
-            # Convert '@prefix' to 'PREFIX'
-            prefix = parts[1]
-            uri = parts[2]
-            sparl_prefix = f"PREFIX {prefix} {uri}"
-            sparl_prefixes.append(sparl_prefix)
 
-    return "\n".join(sparl_prefixes)
-
-
-def read_ontology_file(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-    return content
+def speculative_classification(query):
+    """Response used when GPT-4 times out and the stored query's results are returned instead."""
+    return {
+        "Classification": "SPARQL",
+        "SPARQL": query,
+        "Response": {
+            "Text": "",
+            "UALs": [],
+        }
+    }
 
 
-def execute_sparql_query(query):
-    try:
-        # Initialize DKG
-        ot_node_hostname = os.getenv("OT_NODE_HOSTNAME_MAINNET")+":8900"
-        node_provider = NodeHTTPProvider(ot_node_hostname)
-        blockchain_provider = BlockchainProvider(
-            os.getenv("RPC_ENDPOINT_MAINNET"), 
-            os.getenv("WALLET_PRIVATE_KEY_MAINNET")
-        )
+def error_classification():
+    return {
+        "Classification": 'Error',
+        "SPARQL": '',
+        "Response": {
+            "Text": '',
+            "UALs": [],
+        }
+    }
+
+
+def build_classification_messages(question, query_matches, entity_matches, ontology_content, history):
+    # Format query and entity matches for the prompt
+    formatted_query_matches = ", ".join([f"Query Match: {match}" for match in query_matches])
+    formatted_entity_matches = ", ".join([f"Entity Match: {match}" for match in entity_matches])
+    pprint("formatted_entity_matches: ")
+    pprint(formatted_entity_matches)
+
+    return [
+        {
+            "role": "system",
+            "content": (
+                "This is for a ReFi chatbot to answer questions about Regenerative Finance (ReFi). "
+                "Upon receiving a prompt, always generate a response using Retrieval Augmented Generation (RAG), "
+                "and also generate a SPARQL query if the prompt can be answered using the provided OWL ontology. "
+                "For RAG, Ignore any of the Entity Matches that are irrelevant to the prompt. Also, Format the response with HTML line breaks (<br>) for use in HTML."
+                "RAG responses should summarize relevant information and, if applicable, include unique UALs of entity matches used. "
+                "SPARQL queries should aggregate total values before filters and include details for clarity. "
+                "Retrieve all attributes for a subject in question when possible, ie retrieve more info than necessary"
+                "Consider the included SPARQL query matches 'Query Matches' from the database when creating the query. "
+                "Even if classified as SPARQL, always try to generate RAG response as well if you can."
+                "Always format responses in JSON, with 'Classification' indicating 'RAG' or 'SPARQL', and include both responses when SPARQL is applicable. "
+                "Ensure RAG responses are formatted with HTML line breaks for display in HTML environments. "
+                "Example output structure for RAG: {'Classification': 'RAG', 'Response': 'Text here <br><br> Additional text.', 'UALs': ['did:example']}. "
+                "For SPARQL: {'Classification': 'SPARQL', 'SPARQL': 'SELECT ?entity WHERE {...}'}."
+            )
+        },
+        {
+            "role": "user",
+            "content": f"prompt: '{question}', Query Matches: '{formatted_query_matches}', Entity Matches: '{formatted_entity_matches}', Ontology: '{ontology_content}'"
+        },
+        *history  # Include chat history in the API call
+    ]
+
+
+_CODE_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+CLASSIFICATIONS = {"rag": "RAG", "sparql": "SPARQL"}
+
+
+def load_json_object(text):
+    """
+    Parses the model output as a JSON object, tolerating a surrounding code fence,
+    text before or after the object, and the single-quoted dict style used in the
+    prompt's examples. Returns None if no object can be recovered.
+    """
+    text = _CODE_FENCE_RE.sub("", text or "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    candidate = text[start:end + 1]
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            data = parse(candidate)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def validate_classification(data):
+    """
+    Coerces a parsed response into the classification schema:
+    Classification is 'RAG' or 'SPARQL', SPARQL is a string, Response.Text is a
+    string and Response.UALs a de-duplicated list of strings. Returns None if the
+    response holds neither an answer nor a query.
+    """
+    # Key case varies between completions
+    data = {key.lower() if isinstance(key, str) else key: value for key, value in data.items()}
+
+    response = data.get("response", "")
+    UALs = data.get("uals", [])
+    if isinstance(response, dict):
+        # {"Response": {"Text": ..., "UALs": [...]}}, i.e. our own output shape
+        UALs = response.get("UALs", response.get("uals", UALs))
+        response = response.get("Text", response.get("text", ""))
+    if not isinstance(response, str):
+        response = str(response) if response is not None else ""
+    if isinstance(UALs, str):
+        UALs = [UALs]
+    if not isinstance(UALs, list):
+        UALs = []
+
+    query = data.get("sparql", "")
+    if not isinstance(query, str):
+        query = ""
+
+    classification = CLASSIFICATIONS.get(str(data.get("classification", "")).strip().lower())
+    if classification is None:
+        # Missing or unknown label: infer it from what the response contains
+        classification = "SPARQL" if query.strip() else "RAG" if response.strip() else None
+    if classification is None:
+        return None
+
+    return {
+        "Classification": classification,
+        "SPARQL": query if classification == "SPARQL" else '',
+        "Response": {
+            "Text": response,
+            # Remove duplicates, keeping the order the model cited them in
+            "UALs": list(dict.fromkeys(str(ual) for ual in UALs if ual)),
+        }
+    }
 
-        # Initialize the DKG client
-        dkg = DKG(node_provider, blockchain_provider)
 
-        # Execute the query
-        query_graph_result = dkg.graph.query(query, repository="privateCurrent")
-        print("query_graph_result: ", query_graph_result)
+def parse_classification(extracted_content):
+    print("Extracted Content:", extracted_content)  # For debugging
+    data = load_json_object(extracted_content)
+    if data is None:
+        print("Response is not a JSON object")
+        return error_classification()
 
-        if query_graph_result:
-            return query_graph_result
-        else:
-            return []
+    result = validate_classification(data)
+    if result is None:
+        print("Classification key missing in response")
+        return error_classification()
+    return result
 
-    except Exception as e:
-        print(f"Error during SPARQL query execution: {e}")
-        return []
 
+def log_classification_cost(prompt_tokens, completion_tokens):
+    # Log token usage for cost estimation
+    OpenAICallCost = 0.01 * prompt_tokens / 1000 + 0.03 * completion_tokens / 1000
+    print(f"extract_entities_and_classify.  input tokens: {prompt_tokens}, output tokens: {completion_tokens}, cost: {OpenAICallCost}")
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost": OpenAICallCost}
 
 
 @timed_function
-def extract_entities_and_classify(question: str, query_matches, entity_matches, ontology_content, history) -> Dict[str, Any]:
+async def extract_entities_and_classify(question: str, query_matches, entity_matches, ontology_content, history, on_delta=None, messages=None) -> Dict[str, Any]:
+    """
+    Classifies the question and generates the RAG response and/or SPARQL query.
+    When on_delta is given the completion is streamed and on_delta is awaited with
+    each new piece of the 'Response' text as it arrives. Token usage and cost are
+    returned under 'Usage' when the API reports them. The call is abandoned after
+    CLASSIFICATION_TIMEOUT seconds, and cancelling the caller cancels the request.
+    Pass messages if the caller has already built them from the other arguments.
+    """
+    usage = None
     try:
-        # Initialize variables
-        query = ''  # Initialize query as an empty string
-        response = ''  # Initialize response as an empty string
-        UALs = []  # Initialize UALs as an empty list
-
-        # Format query and entity matches for the prompt
-        formatted_query_matches = ", ".join([f"Query Match: {match}" for match in query_matches])
-        formatted_entity_matches = ", ".join([f"Entity Match: {match}" for match in entity_matches])
-        pprint("formatted_entity_matches: ")
-        pprint(formatted_entity_matches)
+        if messages is None:
+            messages = build_classification_messages(question, query_matches, entity_matches, ontology_content, history)
 
         # Call the OpenAI ChatCompletion API
-        completion = client.chat.completions.create(
+        completion_args = dict(
             model="gpt-4-0125-preview",
             temperature=0.1,
             response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "This is for a ReFi chatbot to answer questions about Regenerative Finance (ReFi). "
-                        "Upon receiving a prompt, always generate a response using Retrieval Augmented Generation (RAG), "
-                        "and also generate a SPARQL query if the prompt can be answered using the provided OWL ontology. "
-                        "For RAG, Ignore any of the Entity Matches that are irrelevant to the prompt. Also, Format the response with HTML line breaks (<br>) for use in HTML."
-                        "RAG responses should summarize relevant information and, if applicable, include unique UALs of entity matches used. "
-                        "SPARQL queries should aggregate total values before filters and include details for clarity. "
-                        "Retrieve all attributes for a subject in question when possible, ie retrieve more info than necessary"
-                        "Consider the included SPARQL query matches 'Query Matches' from the database when creating the query. "
-                        "Even if classified as SPARQL, always try to generate RAG response as well if you can."
-                        "Always format responses in JSON, with 'Classification' indicating 'RAG' or 'SPARQL', and include both responses when SPARQL is applicable. "
-                        "Ensure RAG responses are formatted with HTML line breaks for display in HTML environments. "
-                        "Example output structure for RAG: {'Classification': 'RAG', 'Response': 'Text here <br><br> Additional text.', 'UALs': ['did:example']}. "
-                        "For SPARQL: {'Classification': 'SPARQL', 'SPARQL': 'SELECT ?entity WHERE {...}'}."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": f"prompt: '{question}', Query Matches: '{formatted_query_matches}', Entity Matches: '{formatted_entity_matches}', Ontology: '{ontology_content}'"
-                },
-                *history  # Include chat history in the API call
-            ]
+            messages=messages,
+            timeout=CLASSIFICATION_TIMEOUT,
         )
 
-        # Log token usage for cost estimation
-        completion_tokens = completion.usage.completion_tokens
-        prompt_tokens = completion.usage.prompt_tokens
-        OpenAICallCost = 0.01 * prompt_tokens / 1000 + 0.03 * completion_tokens / 1000
-        print(f"extract_entities_and_classify.  input tokens: {prompt_tokens}, output tokens: {completion_tokens}, cost: {OpenAICallCost}")
+        async def complete():
+            nonlocal usage
+            if on_delta is None:
+                completion = await retry_async("openai", get_async_openai_client().chat.completions.create, slot="openai", **completion_args)
+                usage = log_classification_cost(completion.usage.prompt_tokens, completion.usage.completion_tokens)
+                return completion.choices[0].message.content
+
+            async def open_stream(held):
+                # The slot of the attempt that opens the stream is kept until the stream has been read
+                async with AsyncExitStack() as attempt:
+                    await attempt.enter_async_context(upstream_slot("openai"))
+                    stream = await get_async_openai_client().chat.completions.create(
+                        **completion_args, stream=True, stream_options={"include_usage": True}
+                    )
+                    held.push_async_exit(attempt.pop_all())
+                    return stream
+
+            # Only opening the stream is retried; a stream that fails midway has already emitted text
+            async with AsyncExitStack() as held:
+                stream = await retry_async("openai", open_stream, held)
+                response_streamer = JSONStringFieldStreamer("Response")
+                chunks = []
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = log_classification_cost(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    chunks.append(chunk.choices[0].delta.content)
+                    text = response_streamer.feed(chunk.choices[0].delta.content)
+                    if text:
+                        await on_delta(text)
+                return "".join(chunks)
+
+        extracted_content = await asyncio.wait_for(complete(), CLASSIFICATION_TIMEOUT)
 
         # Processing API response
-        extracted_content = completion.choices[0].message.content
-        print("Extracted Content:", extracted_content)  # For debugging
-        data = json.loads(extracted_content)
-
-        classification = data.get("Classification", "Error")
-        if classification != "Error":
-            if classification == "SPARQL":
-                query = data.get("SPARQL", '')
-            response = data.get("Response", "")
-            UALs = data.get("UALs", [])
-
-            # Remove duplicates by converting the list to a set, then back to a list
-            unique_UALs = list(set(UALs))
-
-            return {
-                "Classification": classification,
-                "SPARQL": query,
-                "Response": {
-                    "Text": response,
-                    "UALs": unique_UALs,  # Return the list with duplicates removed
-                }
-            }
-        else:
-            print("Classification key missing in response")
-            return {
-                "Classification": 'Error',
-                "SPARQL": '',
-                "Response": {
-                    "Text": '',
-                    "UALs": [],
-                }
-            }
-
+        result = parse_classification(extracted_content)
+
+    except Overloaded:
+        # Rate limited even after retrying; let the caller answer with 503 instead of an error message
+        raise
+    except asyncio.TimeoutError:
+        print(f"Classification timed out after {CLASSIFICATION_TIMEOUT}s")
+        result = error_classification()
     except Exception as e:
         print(f"Error occurred: {e}")
-        return {
-            "Classification": 'Error',
-            "SPARQL": '',
-            "Response": {
-                "Text": '',
-                "UALs": [],
-            }
-        }
-
-
-@timed_function
-def similarity_search(question, milvus_client, collection_name):
-    # Convert question to embedding
-    query_embedding = convert_to_embeddings([question])[0]
+        result = error_classification()
 
-    # Define output fields based on the collection
-    output_fields = ["EntityID", "RAG", "UAL"] if collection_name == "EntityCollection" else ["combined"]
+    if usage is not None:
+        result["Usage"] = usage
+    return result
 
-    # Perform search for the query embedding
-    try:
-        search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
-        res = milvus_client.search(
-            collection_name=collection_name,
-            data=[query_embedding],
-            output_fields=output_fields,
-            limit=5,
-            search_params=search_params
-        )
-        # Adjust the following line based on the actual format of res
-        return [hit.entity if hasattr(hit, 'entity') else hit for hit in res[0]]
-    except Exception as e:
-        print(f"Error during Milvus similarity search: {e}")
-        return []
 
 def format_query_result(query_results):
     """
@@ -237,25 +286,172 @@ def format_query_result(query_results):
         formatted_results += "<br>" + formatted_item
     return formatted_results
 
-@timed_function
-async def RAGandSPARQL(question, history):
-    pprint("Starting RAGandSPARQL with question: " + question)
-    ontology_file_path = "Ontology/ontology.ttl"
-    ontology_content = read_ontology_file(ontology_file_path)
-    
-    executor = concurrent.futures.ThreadPoolExecutor()
-    loop = asyncio.get_event_loop()
+async def run_pipeline(question, history, stages=(), emit=None):
+    """
+    Runs the shared retrieval -> classification -> SPARQL hot path and then each
+    post-processing stage in order. Stages receive the pipeline context dict and
+    may be plain or async callables; they add their output to the context.
 
-    initial_matches_task = loop.run_in_executor(executor, similarity_search, question, milvus_client, "EntityCollection")
-    query_search_results_task = loop.run_in_executor(executor, similarity_search, question, milvus_client, "QueryCollection")
-    
-    initial_matches, query_search_results = await asyncio.gather(initial_matches_task, query_search_results_task)
+    If emit is given, it is awaited as emit(event, data) as each step completes:
+    "matches" after retrieval, "rag_delta" for each streamed piece of the RAG
+    text and "sparql_results" after the query runs.
+    """
+    pprint("Starting RAGandSPARQL with question: " + question)
+    ontology = ontology_registry.get()
+
+    context = {
+        "question": question,
+        "history": history,
+        "timings": {},  # seconds spent in each step
+        "llm_usage": None,
+        "semantic_cache_hit": False,
+        "sparql_cache_hit": False,
+        "sparql_expected": False,
+        "sparql_query": "",
+        "sparql_results": [],
+    }
+    timings = context["timings"]
+
+    # The question embedding is shared by both searches and the semantic cache
+    # (concurrent requests are batched into one encode call by the embedding service)
+    with span("embedding", timings):
+        question_embedding = await embedding_service.encode(question)
+
+    with span("retrieval", timings):
+        # With reranking, over-fetch entity candidates and keep the best few
+        hits = await search_all(question_embedding, limits={ENTITY_COLLECTION: RERANK_CANDIDATES} if RERANK_ENABLED else None)
+    entity_hits, query_hits = hits[ENTITY_COLLECTION], hits[QUERY_COLLECTION]
+    if HYBRID_SEARCH_ENABLED:
+        # Exact names, handles and UALs from the keyword index, merged by rank with the vector hits
+        with span("keyword_search", timings):
+            entity_limit = RERANK_CANDIDATES if RERANK_ENABLED else SEARCH_CONFIG[ENTITY_COLLECTION]["limit"]
+            entity_hits = await hybrid_entity_hits(question, entity_hits, entity_limit)
+    if RERANK_ENABLED:
+        with span("rerank", timings):
+            entity_hits = await rerank(question, entity_hits)
+    context["entity_matches"] = entity_hits
+    context["query_matches"] = query_hits
+
+    # The LLM prompt and the semantic cache only need the stored fields of each hit
+    initial_matches = [hit.fields for hit in entity_hits]
+    query_search_results = [hit.fields for hit in query_hits]
+
+    if emit is not None:
+        await emit("matches", {
+            "entities": [{"EntityID": hit.get("EntityID"), "UAL": hit.get("UAL"), "distance": hit.distance, "score": hit.score} for hit in entity_hits],
+            "queries": len(query_hits),
+        })
+
+    # Run the stored query of a near-identical canned question while the LLM works
+    speculative = None
+    closest_distance = query_hits[0].distance if query_hits else None
+    if SPECULATIVE_SPARQL_ENABLED and closest_distance is not None and closest_distance <= SPECULATIVE_SPARQL_MAX_DISTANCE:
+        speculative_query = stored_sparql(query_hits[0])
+        if speculative_query:
+            speculative_with_prefixes = prepend_ontology_prefixes(speculative_query, ontology.sparql_prefixes)
+            speculative_status = {}
+            speculative = {
+                "query": speculative_query,
+                "key": normalize_query(speculative_with_prefixes),
+                "status": speculative_status,
+                "task": asyncio.create_task(execute_sparql_query_async(speculative_with_prefixes, speculative_status)),
+            }
+    context["speculative_sparql"] = "started" if speculative else None
 
-    # Adjusted to expect a single dictionary return
-    response_data = await loop.run_in_executor(executor, extract_entities_and_classify, question, query_search_results, initial_matches, ontology_content, history)
-    
+    speculative_task = speculative["task"] if speculative else None
+    # However the rest of the pipeline ends (an error, a cancelled request), the speculative
+    # task is cancelled. A query already sent to the node still finishes in its thread and
+    # keeps its DKG slot until then (see execute_sparql_query_async)
+    try:
+        # Answers depend on the conversation, so only history-free questions use the semantic cache
+        use_semantic_cache = SEMANTIC_CACHE_ENABLED and not history
+        response_data = None
+        if use_semantic_cache:
+            response_data = semantic_cache.lookup(question_embedding, initial_matches)
+        context["semantic_cache_hit"] = response_data is not None
+
+        if response_data is None:
+            on_delta = None
+            if emit is not None:
+                async def on_delta(text):
+                    await emit("rag_delta", {"text": text})
+
+            # Only the ontology fragments and match text relevant to the question go in the prompt
+            prompt_queries, prompt_entities, prompt_ontology = build_prompt_inputs(question, query_search_results, initial_matches, ontology)
+
+            # Wait for room in the OpenAI quota (prompt plus the expected answer length)
+            messages = build_classification_messages(question, prompt_queries, prompt_entities, prompt_ontology, history)
+            await openai_quota(estimate_tokens(json.dumps(messages)) + CLASSIFICATION_COMPLETION_TOKENS)
+
+            # Adjusted to expect a single dictionary return
+            llm_timed_out = False
+            with span("llm", timings):
+                # The call slot is taken per attempt inside, so it is not held while backing off
+                llm_call = extract_entities_and_classify(question, prompt_queries, prompt_entities, prompt_ontology, history, on_delta, messages)
+                if speculative is None:
+                    response_data = await llm_call
+                else:
+                    try:
+                        response_data = await asyncio.wait_for(llm_call, SPECULATIVE_LLM_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        # The speculative results become the answer; wait_for has cancelled the OpenAI request
+                        print(f"LLM timed out after {SPECULATIVE_LLM_TIMEOUT}s, answering with the stored query")
+                        llm_timed_out = True
+                        response_data = speculative_classification(speculative["query"])
+            context["llm_usage"] = response_data.pop("Usage", None)
+            if llm_timed_out:
+                context["speculative_sparql"] = "llm_timeout"
+            elif use_semantic_cache and response_data.get("Classification", "Error") != "Error":
+                semantic_cache.store(question_embedding, initial_matches, response_data)
+        elif emit is not None:
+            await emit("rag_delta", {"text": response_data.get("Response", {}).get("Text", "")})
+        context["response_data"] = response_data
+
+        # Execute the SPARQL query if present
+        classification = response_data.get("Classification", "Error")
+        if classification == "SPARQL" or response_data.get("SPARQL"):
+            context["sparql_expected"] = True
+            query = response_data.get("SPARQL", "")
+            if query:
+                context["sparql_query"] = query
+                query_with_prefixes = prepend_ontology_prefixes(query, ontology.sparql_prefixes)
+                if speculative is not None and normalize_query(query_with_prefixes) == speculative["key"]:
+                    # Already running (or finished) since retrieval
+                    if context["speculative_sparql"] != "llm_timeout":
+                        context["speculative_sparql"] = "used"
+                    sparql_status = speculative["status"]
+                    with span("sparql", timings):
+                        context["sparql_results"] = await speculative["task"]
+                    speculative = None
+                else:
+                    sparql_status = {}
+                    with span("sparql", timings):
+                        context["sparql_results"] = await execute_sparql_query_async(query_with_prefixes, sparql_status)
+                context["sparql_cache_hit"] = sparql_status.get("cache_hit", False)
+                if emit is not None:
+                    await emit("sparql_results", {"query": query, "results": context["sparql_results"]})
+
+        if speculative is not None:
+            # The LLM chose a different query (or none); its results are not needed
+            speculative["task"].cancel()
+            context["speculative_sparql"] = "discarded"
+    finally:
+        if speculative_task is not None and not speculative_task.done():
+            speculative_task.cancel()
+
+    for stage in stages:
+        with span(stage.__name__, timings):
+            result = stage(context)
+            if inspect.isawaitable(result):
+                await result
+
+    return context
+
+
+def html_response_stage(context):
+    """Post-processing stage that renders the pipeline context as the HTML chat response."""
+    response_data = context["response_data"]
     final_response = {"Text": ""}
-    classification = response_data.get("Classification", "Error")
 
     # Always attempt to include a RAG response
     rag_response = response_data.get("Response", {}).get("Text", "")
@@ -272,12 +468,10 @@ async def RAGandSPARQL(question, history):
             # Add a double line break and space before "Knowledge Assets:"
             final_response["Text"] += "<br><br>Knowledge Assets:<br>" + links_str
 
-    # Include SPARQL query if present
-    if classification == "SPARQL" or response_data.get("SPARQL"):
-        query = response_data.get("SPARQL", "")
-        if query:
-            query_with_prefixes = prepend_ontology_prefixes(query, ontology_content)
-            sparql_results = execute_sparql_query(query_with_prefixes)
+    # Include SPARQL results if a query was expected
+    if context["sparql_expected"]:
+        if context["sparql_query"]:
+            sparql_results = context["sparql_results"]
             if sparql_results:
                 formatted_results = format_query_result(sparql_results)
                 final_response["Text"] += "Results:\n" + formatted_results
@@ -289,7 +483,13 @@ async def RAGandSPARQL(question, history):
     if not final_response["Text"].strip():
         final_response = {"Text": "No results found."}
 
-    return final_response
+    context["final_response"] = final_response
+
+
+@timed_function
+async def RAGandSPARQL(question, history):
+    context = await run_pipeline(question, history, stages=[html_response_stage])
+    return context["final_response"]
 
     
 if __name__ == "__main__":
@@ -1,14 +1,78 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+import os
+import time
+import asyncio
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from pprint import pprint
 import RAG_SPARQL_MAINNET
-from twitter_processing_mainnet import process_query_for_twitter
+from twitter_processing_mainnet import TWITTER_STAGES, twitter_response
 from tweet_Info import find_tweet_by_id
+import shared_resources
+from ontology_registry import ontology_registry
+from dkg_client import dkg_pool
+from sparql_cache import sparql_cache, invalidate_sparql_cache
+from embedding_service import embedding_service
+import retrieval
+from streaming import format_sse
+from audit_log import audit_log, pipeline_audit_fields
+import metrics
+from semantic_cache import semantic_cache
+from embedding_cache import embedding_cache
+from concurrency import Overloaded, admission_queue
+from single_flight import pipeline_flights, request_key
+import reranker
+import keyword_index
 import logging
 from logging.handlers import RotatingFileHandler
 
-app = FastAPI()
+# With fast start the worker accepts connections (and answers /health) while the
+# model and clients load in the background; /ready reports when that is done.
+FAST_START = os.getenv("FAST_START", "true").lower() == "true"
+
+startup_state = {"ready": False, "error": None}
+
+def warm_up():
+    # Load the embedding model and create the shared clients once per worker
+    shared_resources.warm_up()
+    if retrieval.VECTOR_BACKEND == "local":
+        import local_index
+        local_index.load_all()
+    reranker.warm_up()
+    keyword_index.warm_up()
+
+async def run_warm_up():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"Warm-up failed: {str(e)}", exc_info=True)
+        return
+    startup_state["ready"] = True
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f} seconds")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    audit_log.start()
+    ontology_registry.start_watching()
+    warm_up_task = asyncio.create_task(run_warm_up())
+    if not FAST_START:
+        await warm_up_task
+    yield
+    # Don't tear the clients down underneath a warm-up that is still running
+    await warm_up_task
+    await embedding_service.stop()
+    await retrieval.close()
+    await shared_resources.close_async_openai_client()
+    ontology_registry.stop_watching()
+    dkg_pool.close()
+    audit_log.stop()
+    shared_resources.shutdown_resources()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure file logging
 log_file = "query_logs.log"
@@ -30,6 +94,61 @@ app.add_middleware(
 # Set up logging
 logger = logging.getLogger("uvicorn.error")
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Use the route template so path parameters don't create a series per value
+        route = request.scope.get("route")
+        path = getattr(route, "path", request.url.path)
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method, path=path, status=status)
+
+@app.get("/health")
+async def health():
+    """Liveness: the worker is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: the embedding model, clients and indexes are loaded."""
+    if startup_state["ready"]:
+        return {"status": "ready"}
+    if startup_state["error"]:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": startup_state["error"]})
+    return JSONResponse(status_code=503, content={"status": "starting"})
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency histograms and cache statistics in the Prometheus text format."""
+    cache_lines = []
+    for cache_name, stats in (
+        ("sparql", sparql_cache.stats()),
+        ("semantic", semantic_cache.stats()),
+        ("embedding", embedding_cache.stats()),
+    ):
+        cache_lines.extend(metrics.render_gauges(
+            f"chatdkg_{cache_name}_cache", f"{cache_name} cache statistics.",
+            stats, "stat",
+        ))
+    cache_lines.extend(metrics.render_gauges(
+        "chatdkg_admission_queue", "Requests in flight, waiting for a slot and rejected with 429.",
+        admission_queue.stats(), "stat",
+    ))
+    cache_lines.extend(metrics.render_gauges(
+        "chatdkg_coalesced_requests", "Pipeline runs in flight, started, and requests that shared another's run.",
+        pipeline_flights.stats(), "stat",
+    ))
+    cache_lines.extend(metrics.render_gauges(
+        "chatdkg_rerank", "Reranked searches, reranks over the latency budget, and hits dropped below the score threshold.",
+        reranker.stats, "stat",
+    ))
+    return PlainTextResponse(metrics.render_metrics(cache_lines), media_type="text/plain; version=0.0.4")
+
 # Define a Pydantic model for the request data
 class QueryRequest(BaseModel):
     question: str
@@ -40,24 +159,128 @@ class FeedbackRequest(BaseModel):
     username: str
     feedback: str
 
+# How often (seconds) a non-streaming request checks that its client is still connected
+DISCONNECT_POLL_INTERVAL = 1.0
+
+class ClientDisconnected(Exception):
+    pass
+
+async def cancel_on_disconnect(request: Request, awaitable):
+    """Awaits awaitable, cancelling it (and so any OpenAI call in progress) if the client goes away."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+async def admitted_pipeline(question, history, stages):
+    async with admission_queue.admit():
+        return await RAG_SPARQL_MAINNET.run_pipeline(question, history, stages=stages)
+
+def overloaded_response(e: Overloaded):
+    # 429 when our own queue is full, 503 when OpenAI is rate limiting us
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(int(e.retry_after + 0.999))})
+
 @app.post("/query")
-async def query(query_request: QueryRequest):
+async def query(query_request: QueryRequest, request: Request):
     try:
         question = query_request.question
         history = query_request.history
         username = query_request.username  # Get the username from the request
 
-        result = await RAG_SPARQL_MAINNET.RAGandSPARQL(question, history)
+        started = time.perf_counter()
+        # Identical concurrent questions share one pipeline run (and one admission slot)
+        context = await cancel_on_disconnect(request, pipeline_flights.run(
+            request_key("query", question, history),
+            admitted_pipeline, question, history, [RAG_SPARQL_MAINNET.html_response_stage],
+        ))
+        result = context["final_response"]
 
         # Log the query, result, and username
-        with open(log_file, 'a') as file:
-            file.write(f"User: {username}, Question: {question}, Result: {result}\n")
+        audit_log.write("query", user=username, question=question, result=result,
+                        total_latency=round(time.perf_counter() - started, 4), **pipeline_audit_fields(context))
 
         return {"result": result}
+    except ClientDisconnected:
+        logger.info(f"Client disconnected, cancelled query for user {username}")
+        return Response(status_code=499)
+    except Overloaded as e:
+        logger.warning(f"Rejected query for user {username}: {str(e)}")
+        raise overloaded_response(e)
     except Exception as e:
         logger.error(f"Internal Server Error: {str(e)} for user {username}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.post("/query/stream")
+async def query_stream(query_request: QueryRequest):
+    """
+    Streaming variant of /query. Emits Server-Sent Events as the pipeline runs:
+    "matches", then "rag_delta" chunks, then "sparql_results" (if any), and finally
+    "result" with the same payload /query returns (or "error").
+    """
+    question = query_request.question
+    history = query_request.history
+    username = query_request.username
+    events = asyncio.Queue()
+
+    # Admit before the stream starts so a full queue is still a plain 429 response
+    try:
+        await admission_queue.acquire()
+    except Overloaded as e:
+        logger.warning(f"Rejected query for user {username}: {str(e)}")
+        raise overloaded_response(e)
+
+    async def emit(event, data):
+        await events.put((event, data))
+
+    async def run():
+        started = time.perf_counter()
+        try:
+            context = await RAG_SPARQL_MAINNET.run_pipeline(
+                question, history, stages=[RAG_SPARQL_MAINNET.html_response_stage], emit=emit
+            )
+            result = context["final_response"]
+
+            # Log the query, result, and username
+            audit_log.write("query_stream", user=username, question=question, result=result,
+                            total_latency=round(time.perf_counter() - started, 4), **pipeline_audit_fields(context))
+
+            await emit("result", {"result": result})
+        except Overloaded as e:
+            await emit("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Internal Server Error: {str(e)} for user {username}", exc_info=True)
+            await emit("error", {"detail": str(e)})
+        finally:
+            await events.put(None)
+
+    # Started here rather than in event_stream so the slot is released even if the
+    # stream is never iterated; a done callback also covers a task cancelled before it ran
+    task = asyncio.create_task(run())
+    task.add_done_callback(lambda _: admission_queue.release())
+
+    async def event_stream():
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield format_sse(*item)
+        finally:
+            # The client went away; stop working on its answer
+            task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/feedback")
 async def feedback(feedback_request: FeedbackRequest):
     try:
@@ -65,8 +288,7 @@ async def feedback(feedback_request: FeedbackRequest):
         feedback = feedback_request.feedback
 
         # Log the feedback
-        with open(log_file, 'a') as file:
-            file.write(f"User: {username}, Feedback: {feedback}\n")
+        audit_log.write("feedback", user=username, feedback=feedback)
 
         return {"message": "Feedback received"}
     except Exception as e:
@@ -80,22 +302,34 @@ class TwitterQueryRequest(BaseModel):
     history: list = []  # Assuming you might want to pass a conversation history or similar
 
 @app.post("/twitterQuery")
-async def twitter_query(twitter_query_request: TwitterQueryRequest):
+async def twitter_query(twitter_query_request: TwitterQueryRequest, request: Request):
     try:
         question = twitter_query_request.question
         history = twitter_query_request.history
         username = twitter_query_request.username  # This now correctly captures the username
 
-        response = await process_query_for_twitter(question, history)
+        started = time.perf_counter()
+        # A viral tweet sends many copies of the same question at once; they share one run
+        context = await cancel_on_disconnect(request, pipeline_flights.run(
+            request_key("twitterQuery", question, history),
+            admitted_pipeline, question, history, TWITTER_STAGES,
+        ))
+        response = twitter_response(context)
 
         print("response in app.py from process_query_for_twitter ")
         print(response)
 
         # Log the query, result, and username
-        with open(log_file, 'a') as file:
-            file.write(f"User: {username}, Question: {question}, Result: {response}\n")
+        audit_log.write("twitterQuery", user=username, question=question, result=response,
+                        total_latency=round(time.perf_counter() - started, 4), **pipeline_audit_fields(context))
 
         return {"result": response}
+    except ClientDisconnected:
+        logger.info(f"Client disconnected, cancelled Twitter query for user {username}")
+        return Response(status_code=499)
+    except Overloaded as e:
+        logger.warning(f"Rejected Twitter query for user {username}: {str(e)}")
+        raise overloaded_response(e)
     except Exception as e:
         logger.error(f"Internal Server Error: {str(e)} for Twitter user  {username}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -113,4 +347,19 @@ def get_tweet(tweet_id: str):
             raise HTTPException(status_code=404, detail="Tweet not found")
     except Exception as e:
         logger.error(f"Error fetching tweet: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(x_admin_token: str = Header(None)):
+    # Call after new Knowledge Assets land on the DKG. Only clears the worker that
+    # receives the request; with several uvicorn workers, restart them instead
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or x_admin_token != admin_token:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    # Answers cached before the new assets landed are stale too
+    dropped = {"sparql": sparql_cache.stats()["entries"], "semantic": semantic_cache.stats()["entries"]}
+    invalidate_sparql_cache()
+    semantic_cache.clear()
+    logger.info(f"SPARQL and semantic caches invalidated, dropped {dropped['sparql']} and {dropped['semantic']} entries")
+    return {"message": "Cache invalidated", "dropped": dropped}
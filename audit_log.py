@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", "query_logs.jsonl")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", "1000000"))
+AUDIT_LOG_BACKUP_COUNT = int(os.getenv("AUDIT_LOG_BACKUP_COUNT", "5"))
+# Records waiting to be written; when full, new records are dropped rather than blocking a request
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "10000"))
+AUDIT_LOG_BATCH_SIZE = 200
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """
+    Writes structured audit records as JSON lines from a background thread.
+    Request handlers only enqueue a dict; the writer drains the queue in batches,
+    rotates the file through RotatingFileHandler and flushes once per batch.
+    """
+
+    def __init__(self, path=AUDIT_LOG_FILE, max_bytes=AUDIT_LOG_MAX_BYTES,
+                 backup_count=AUDIT_LOG_BACKUP_COUNT, queue_size=AUDIT_LOG_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._handler = None
+        self._thread = None
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                            backupCount=self.backup_count, delay=True)
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flushes everything queued so far and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._handler.close()
+        self._handler = None
+
+    def write(self, event, **fields):
+        """Queue one record. Never blocks; returns False if the record was dropped."""
+        if self._thread is None:
+            self.start()
+        record = {"ts": time.time(), "event": event, **fields}
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < AUDIT_LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is _STOP for record in batch)
+            try:
+                self._write_batch([record for record in batch if record is not _STOP])
+            except Exception as e:
+                print(f"Error writing audit log: {e}")
+            if stop:
+                return
+
+    def _write_batch(self, records):
+        handler = self._handler
+        with handler.lock:
+            for record in records:
+                line = json.dumps(record, default=str)
+                log_record = logging.makeLogRecord({"msg": line})
+                if handler.shouldRollover(log_record):
+                    handler.doRollover()
+                if handler.stream is None:
+                    handler.stream = handler._open()
+                handler.stream.write(line + "\n")
+            if handler.stream is not None:
+                handler.stream.flush()
+
+
+def pipeline_audit_fields(context):
+    """The parts of a run_pipeline context that go into an audit record."""
+    usage = context.get("llm_usage") or {}
+    return {
+        "classification": context.get("response_data", {}).get("Classification"),
+        "latency": {stage: round(seconds, 4) for stage, seconds in context.get("timings", {}).items()},
+        "cost": usage.get("cost", 0.0),
+        "tokens": {"prompt": usage.get("prompt_tokens", 0), "completion": usage.get("completion_tokens", 0)},
+        "cache_hits": {
+            "semantic": context.get("semantic_cache_hit", False),
+            "sparql": context.get("sparql_cache_hit", False),
+        },
+        "speculative_sparql": context.get("speculative_sparql"),
+    }
+
+
+audit_log = AuditLogWriter()
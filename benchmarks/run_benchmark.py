@@ -0,0 +1,244 @@
+"""
+Replays a question corpus through the query pipeline with offline stand-ins for
+OpenAI, Milvus and the DKG, and reports throughput, per-stage latency
+percentiles and memory use.
+
+    python benchmarks/run_benchmark.py --requests 200 --concurrency 16
+    python benchmarks/run_benchmark.py --output bench.json
+    python benchmarks/run_benchmark.py --baseline bench.json --max-regression 0.2
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", action="append", default=[],
+                        help="TSV with a 'question' column, or a query log (JSON lines or legacy "
+                             "'User: ..., Question: ...' lines). Defaults to Embeddings/queriesMainnet.tsv.")
+    parser.add_argument("--requests", type=int, default=100, help="Total pipeline runs.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Pipeline runs in flight at once.")
+    parser.add_argument("--endpoint", choices=["query", "twitter"], default="query",
+                        help="Which post-processing stages to run.")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds per stand-in GPT call.")
+    parser.add_argument("--vector-latency", type=float, default=0.05, help="Seconds per stand-in vector search.")
+    parser.add_argument("--dkg-latency", type=float, default=0.2, help="Seconds per stand-in SPARQL query.")
+    parser.add_argument("--embedding-latency", type=float, default=0.005, help="Seconds per stand-in encode call.")
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Use the real MiniLM model instead of hash embeddings.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the semantic and SPARQL result caches.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report peak Python allocations with tracemalloc (slows the run down).")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own prints.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file.")
+    parser.add_argument("--baseline", help="JSON report to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail if a p95 is more than this fraction slower than the baseline.")
+    return parser.parse_args()
+
+
+def load_corpus(paths):
+    questions = []
+    for path in paths:
+        if path.endswith(".tsv"):
+            with open(path, newline='', encoding='utf-8') as file:
+                questions.extend(row["question"] for row in csv.DictReader(file, delimiter='\t') if row.get("question"))
+            continue
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    if record.get("question"):
+                        questions.append(record["question"])
+                    continue
+                # Legacy app.py log lines: "User: <name>, Question: <question>, Result: <result>"
+                match = re.match(r"User: .*?, Question: (.*?), Result: ", line)
+                if match:
+                    questions.append(match.group(1))
+    return questions
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def configure_environment(args, index_dir):
+    # Must run before the pipeline modules are imported; they read these at import time
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = index_dir
+    # Stand-in vectors must not end up in the real embedding store
+    os.environ["EMBEDDING_STORE_DIR"] = os.path.join(index_dir, "embedding_store")
+    os.environ.setdefault("OPENAI_KEY", "benchmark")
+    os.environ.setdefault("OT_NODE_HOSTNAME_MAINNET", "http://stand-in")
+    if args.no_cache:
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["SPARQL_CACHE_TTL"] = "0"
+
+
+def install_stand_ins(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stand_ins import HashEmbeddingModel, FakeAsyncOpenAI, StubDKG
+    import shared_resources
+    import retrieval
+    import dkg_client
+
+    # The getters only create what is still missing, so pre-seed the stand-ins
+    # (an OpenAI client stored without a loop is used on any loop)
+    shared_resources._async_openai_client = FakeAsyncOpenAI(latency=args.llm_latency)
+    if not args.real_embeddings:
+        shared_resources._sentence_model = HashEmbeddingModel(latency=args.embedding_latency)
+    shared_resources.init_resources()
+
+    dkg_client.dkg_pool.factory = lambda: StubDKG(latency=args.dkg_latency)
+
+    search = retrieval.search_collection_async
+
+    async def search_with_latency(collection_name, query_embedding, config=None):
+        await asyncio.sleep(args.vector_latency)
+        return await search(collection_name, query_embedding, config)
+
+    retrieval.search_collection_async = search_with_latency
+
+
+async def run_load(questions, args):
+    import RAG_SPARQL_MAINNET
+    stages = [RAG_SPARQL_MAINNET.html_response_stage]
+    if args.endpoint == "twitter":
+        from twitter_processing_mainnet import TWITTER_STAGES
+        stages = TWITTER_STAGES
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    samples = []
+    errors = 0
+
+    async def one(question):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                context = await RAG_SPARQL_MAINNET.run_pipeline(question, [], stages=stages)
+            except Exception as e:
+                errors += 1
+                print(f"Pipeline error: {e}")
+                return
+            samples.append({"total": time.perf_counter() - started, **context["timings"]})
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(question) for question in questions])
+    return samples, errors, time.perf_counter() - started
+
+
+def build_report(samples, errors, wall_time, args):
+    stages = sorted({stage for sample in samples for stage in sample})
+    latency = {}
+    for stage in stages:
+        values = [sample[stage] for sample in samples if stage in sample]
+        latency[stage] = {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    report = {
+        "requests": len(samples),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "wall_time": wall_time,
+        "requests_per_second": len(samples) / wall_time if wall_time else 0.0,
+        "latency": latency,
+        "memory": {},
+    }
+    if tracemalloc.is_tracing():
+        report["memory"]["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+    try:
+        import resource
+        # ru_maxrss is KiB on Linux
+        report["memory"]["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests, {report['errors']} errors, concurrency {report['concurrency']}")
+    print(f"throughput: {report['requests_per_second']:.2f} req/s over {report['wall_time']:.2f}s")
+    print(f"{'stage':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in report["latency"].items():
+        print(f"{stage:<28}{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+    memory = report["memory"]
+    if "peak_traced_bytes" in memory:
+        print(f"peak traced Python memory: {memory['peak_traced_bytes'] / 2**20:.1f} MiB")
+    if "max_rss_bytes" in memory:
+        print(f"max RSS: {memory['max_rss_bytes'] / 2**20:.1f} MiB")
+
+
+def compare_to_baseline(report, baseline, max_regression):
+    """Returns the stages whose p95 regressed by more than max_regression."""
+    regressions = []
+    for stage, stats in report["latency"].items():
+        previous = baseline.get("latency", {}).get(stage)
+        if previous and previous["p95"] > 0 and stats["p95"] > previous["p95"] * (1 + max_regression):
+            regressions.append((stage, previous["p95"], stats["p95"]))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    random.seed(args.seed)
+
+    corpus = load_corpus(args.corpus or ["Embeddings/queriesMainnet.tsv"])
+    if not corpus:
+        sys.exit("The corpus contains no questions")
+    questions = [random.choice(corpus) for _ in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        configure_environment(args, index_dir)
+        install_stand_ins(args)
+        import local_index
+        import keyword_index
+        local_index.load_all()
+        keyword_index.warm_up()
+
+        if args.trace_memory:
+            tracemalloc.start()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            samples, errors, wall_time = asyncio.run(run_load(questions, args))
+        report = build_report(samples, errors, wall_time, args)
+        tracemalloc.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_to_baseline(report, json.load(file), args.max_regression)
+        for stage, before, after in regressions:
+            print(f"REGRESSION {stage}: p95 {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Offline stand-ins for the services the query pipeline talks to. Each one has a
+configurable latency so the benchmark can model a slow upstream without
+touching OpenAI, Milvus or an OT node.
+"""
+import json
+import time
+import asyncio
+import types
+import hashlib
+import numpy as np
+
+EMBEDDING_DIMENSION = 384
+
+
+class HashEmbeddingModel:
+    """Deterministic replacement for SentenceTransformer.encode (vectors from a text hash)."""
+
+    def __init__(self, latency=0.0, per_text_latency=0.0):
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def encode(self, texts, convert_to_numpy=True, convert_to_tensor=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha256(text.lower().encode("utf-8")).hexdigest()[:16], 16))
+            .standard_normal(EMBEDDING_DIMENSION).astype(np.float32)
+            for text in texts
+        ])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors[0] if single else vectors
+
+
+class _Completions:
+    def __init__(self, latency, stream_chunk_latency):
+        self.latency = latency
+        self.stream_chunk_latency = stream_chunk_latency
+
+    def _content(self, kwargs):
+        if kwargs.get("response_format"):
+            return json.dumps({
+                "Classification": "SPARQL",
+                "Response": "Stand-in answer.<br><br>It mentions a few entities.",
+                "UALs": ["did:dkg:otp/0x0000000000000000000000000000000000000000/1"],
+                "SPARQL": "SELECT ?name WHERE { ?entity a <http://schema.org/Person> . ?entity <http://schema.org/name> ?name . } LIMIT 5",
+            })
+        return "Stand-in summary for Twitter."
+
+    async def create(self, stream=False, **kwargs):
+        content = self._content(kwargs)
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in kwargs.get("messages", [])) // 4
+        usage = types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4)
+        if not stream:
+            await asyncio.sleep(self.latency)
+            message = types.SimpleNamespace(content=content)
+            return types.SimpleNamespace(usage=usage, choices=[types.SimpleNamespace(message=message)])
+
+        async def chunks():
+            await asyncio.sleep(self.latency / 2)
+            for i in range(0, len(content), 8):
+                await asyncio.sleep(self.stream_chunk_latency)
+                delta = types.SimpleNamespace(content=content[i:i + 8])
+                yield types.SimpleNamespace(usage=None, choices=[types.SimpleNamespace(delta=delta)])
+            yield types.SimpleNamespace(usage=usage, choices=[])
+        return chunks()
+
+
+class FakeAsyncOpenAI:
+    """Replacement for openai.AsyncOpenAI returning a fixed JSON classification."""
+
+    def __init__(self, latency=1.0, stream_chunk_latency=0.005):
+        self.chat = types.SimpleNamespace(completions=_Completions(latency, stream_chunk_latency))
+
+    async def close(self):
+        pass
+
+
+class StubDKG:
+    """Replacement for dkg.DKG answering every SPARQL query with a few rows."""
+
+    def __init__(self, latency=0.2, rows=5):
+        latency_ = latency
+
+        class _Graph:
+            def query(self, query, repository=None):
+                time.sleep(latency_)
+                return [{"name": f"Stand-in {i}"} for i in range(rows)]
+
+        self.graph = _Graph()
+        self.node = types.SimpleNamespace(info={"version": "stand-in"})
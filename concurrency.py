@@ -0,0 +1,276 @@
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+
+# Pipelines running at once, and how many more may wait for a slot before new
+# requests are turned away with 429
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "32"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "64"))
+# Seconds a queued request waits for a slot before it is turned away
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# Calls in flight per upstream service. DKG queries run on the shared executor, so
+# its limit also keeps a slow node from taking every worker thread.
+UPSTREAM_LIMITS = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+    "milvus": int(os.getenv("MILVUS_MAX_CONCURRENCY", "16")),
+    "dkg": int(os.getenv("DKG_MAX_CONCURRENCY", os.getenv("DKG_POOL_SIZE", "2"))),
+}
+
+# Set these to the account's OpenAI quotas (requests and tokens per minute); 0 disables the limit
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be served right now; the client should retry later."""
+    status_code = 429
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamOverloaded(Overloaded):
+    """An upstream service kept rejecting calls (rate limited or unavailable) after retries."""
+    status_code = 503
+
+
+class _LoopLocal:
+    # asyncio primitives belong to the loop they are first used on; recreate them for a new loop
+    def __init__(self, factory):
+        self.factory = factory
+        self._loop = None
+        self._value = None
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._value = self.factory()
+        return self._value
+
+
+class AdmissionQueue:
+    """
+    Bounds the requests being processed at once. Requests beyond max_concurrent
+    wait in line; once max_waiting are already waiting, or a request has waited
+    timeout seconds, Overloaded is raised instead.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_waiting=MAX_QUEUED_REQUESTS,
+                 timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._semaphore = _LoopLocal(lambda: asyncio.Semaphore(max_concurrent))
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        semaphore = self._semaphore.get()
+        if not semaphore.locked():
+            # Free slot: acquire() returns without suspending
+            await semaphore.acquire()
+        else:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded("Too many requests in progress, try again shortly")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded("Timed out waiting for a free request slot")
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.get().release()
+
+    @asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second refill up to capacity. A rate of 0 means unlimited."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = _LoopLocal(asyncio.Lock)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        # A request larger than the bucket would otherwise wait forever
+        tokens = min(tokens, self.capacity)
+        # The lock keeps waiters in arrival order
+        async with self._lock.get():
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+def per_minute_bucket(limit):
+    # A full minute's quota as burst capacity, refilled continuously
+    return TokenBucket(limit / 60, limit)
+
+
+_upstream_semaphores = {name: _LoopLocal(lambda limit=limit: asyncio.Semaphore(limit)) for name, limit in UPSTREAM_LIMITS.items()}
+
+openai_request_bucket = per_minute_bucket(OPENAI_RPM)
+openai_token_bucket = per_minute_bucket(OPENAI_TPM)
+
+admission_queue = AdmissionQueue()
+
+
+@asynccontextmanager
+async def upstream_slot(name):
+    """Holds one of the concurrent call slots for an upstream service."""
+    async with _upstream_semaphores[name].get():
+        yield
+
+
+async def run_in_upstream_slot(name, executor, fn, *args):
+    """
+    Runs fn on the executor holding one of the upstream's call slots. The slot is
+    given back when fn returns, not when the caller stops waiting: cancelling the
+    caller cannot stop a call already running in a thread, so that call keeps
+    counting against the limit until it has finished.
+    """
+    semaphore = _upstream_semaphores[name].get()
+    await semaphore.acquire()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except BaseException:
+        semaphore.release()
+        raise
+    future.add_done_callback(lambda done: _release_slot(semaphore, done))
+    return await asyncio.shield(future)
+
+
+def _release_slot(semaphore, future):
+    semaphore.release()
+    # Retrieve the outcome, so the error of a call nobody waits for any more is not logged as unretrieved
+    if not future.cancelled():
+        future.exception()
+
+
+async def openai_quota(estimated_tokens):
+    """Waits until one more request and estimated_tokens fit in the OpenAI per-minute quotas."""
+    await openai_request_bucket.acquire(1)
+    await openai_token_bucket.acquire(estimated_tokens)
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_transient(exc):
+    """Rate limits, 5xx responses, timeouts and dropped connections are worth retrying."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if _status_code(exc) in TRANSIENT_STATUS_CODES:
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status code, and the
+    # requests exceptions used by the DKG node provider do not subclass the builtins
+    if type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "ServiceUnavailableError",
+                              "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout"):
+        return True
+    # The DKG client wraps transport errors in its own NodeRequestError
+    cause = exc.__cause__ or exc.__context__
+    return cause is not None and is_transient(cause)
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, exc=None, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff, or the server's Retry-After when it sent one."""
+    retry_after = _retry_after(exc) if exc is not None else None
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def _give_up(upstream, exc):
+    if _status_code(exc) == 429 or type(exc).__name__ == "RateLimitError":
+        raise UpstreamOverloaded(f"{upstream} is rate limiting requests", retry_after=_retry_after(exc) or RETRY_MAX_DELAY) from exc
+    raise exc
+
+
+def retry_call(upstream, fn, *args, attempts=RETRY_ATTEMPTS, **kwargs):
+    """
+    Calls fn, retrying transient errors with jittered backoff. Blocking; for code
+    running on the executor. If an upstream is still rate limiting after the last
+    attempt, UpstreamOverloaded is raised.
+    """
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            if attempt == attempts - 1:
+                _give_up(upstream, e)
+            delay = backoff_delay(attempt, e)
+            print(f"{upstream} call failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def retry_async(upstream, fn, *args, attempts=RETRY_ATTEMPTS, slot=None, **kwargs):
+    """
+    retry_call for coroutine functions. If slot names an upstream, each attempt
+    holds one of its call slots; the slot is given back while backing off.
+    """
+    for attempt in range(attempts):
+        try:
+            if slot is None:
+                return await fn(*args, **kwargs)
+            async with upstream_slot(slot):
+                return await fn(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            if attempt == attempts - 1:
+                _give_up(upstream, e)
+            delay = backoff_delay(attempt, e)
+            print(f"{upstream} call failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,145 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from shared_resources import get_executor
+from sparql_cache import sparql_cache
+from concurrency import is_transient, retry_async, run_in_upstream_slot
+
+load_dotenv()
+
+# Number of DKG clients kept open; bounds concurrent queries against the OT node
+DKG_POOL_SIZE = int(os.getenv("DKG_POOL_SIZE", "2"))
+# Clients idle for longer than this (seconds) are pinged before being reused
+DKG_HEALTH_CHECK_INTERVAL = float(os.getenv("DKG_HEALTH_CHECK_INTERVAL", "60"))
+# Seconds to wait for a free client before giving up on a query
+DKG_ACQUIRE_TIMEOUT = float(os.getenv("DKG_ACQUIRE_TIMEOUT", "30"))
+
+
+def create_dkg_client():
+    # dkg pulls in web3; import it when the first client is created, not at startup
+    from dkg import DKG
+    from dkg.providers import BlockchainProvider, NodeHTTPProvider
+
+    # Initialize DKG
+    ot_node_hostname = os.getenv("OT_NODE_HOSTNAME_MAINNET")+":8900"
+    # NodeHTTPProvider calls requests.get/post directly and takes no Session, so each
+    # node request opens a new connection; only the web3 provider's session is reused
+    node_provider = NodeHTTPProvider(ot_node_hostname)
+    blockchain_provider = BlockchainProvider(
+        os.getenv("RPC_ENDPOINT_MAINNET"),
+        os.getenv("WALLET_PRIVATE_KEY_MAINNET")
+    )
+
+    # Initialize the DKG client
+    return DKG(node_provider, blockchain_provider)
+
+
+class DKGClientPool:
+    """
+    Long-lived DKG clients shared by all requests. Clients are created on first
+    use, health checked when they have been idle for a while and replaced when a
+    query fails with a transport error, so a dropped node connection is repaired
+    on the next request.
+    """
+
+    def __init__(self, size=DKG_POOL_SIZE, factory=create_dkg_client,
+                 health_check_interval=DKG_HEALTH_CHECK_INTERVAL):
+        self.size = size
+        self.factory = factory
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _new_entry(self):
+        return {"client": self.factory(), "last_used": time.monotonic()}
+
+    def _is_healthy(self, entry):
+        if time.monotonic() - entry["last_used"] < self.health_check_interval:
+            return True
+        try:
+            entry["client"].node.info
+            return True
+        except Exception as e:
+            print(f"DKG client failed health check, reconnecting: {e}")
+            return False
+
+    @contextmanager
+    def lease(self, timeout=DKG_ACQUIRE_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for a free DKG client")
+        try:
+            try:
+                entry = self._idle.get_nowait()
+                if not self._is_healthy(entry):
+                    entry = self._new_entry()
+            except queue.Empty:
+                entry = self._new_entry()
+            yield entry
+            # Entries marked broken (or leases that raised) are dropped, not reused
+            if not entry.get("broken") and not self._closed:
+                entry["last_used"] = time.monotonic()
+                self._idle.put(entry)
+        finally:
+            self._slots.release()
+
+    def query(self, query, repository="privateCurrent"):
+        """
+        Runs a SPARQL query once. A client that fails with a transport error is
+        dropped so the next lease builds a fresh one; after any other error (a bad
+        query, say) the client goes back to the pool. Either way the error is raised.
+        """
+        with self.lease() as entry:
+            try:
+                return entry["client"].graph.query(query, repository=repository)
+            except Exception as e:
+                entry["broken"] = is_transient(e)
+                error = e
+        raise error
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+
+dkg_pool = DKGClientPool()
+
+
+def _cached_or_query(query, status):
+    # Blocking, and called once a DKG slot is free: a query queued behind the same
+    # one is then answered from the cache instead of running again
+    cached_result = sparql_cache.get(query)
+    if status is not None:
+        status["cache_hit"] = cached_result is not None
+    if cached_result is not None:
+        print("query_graph_result served from cache")
+        return cached_result
+
+    query_graph_result = dkg_pool.query(query, repository="privateCurrent")
+    print("query_graph_result: ", query_graph_result)
+    # Only successful queries are cached; errors are raised to the caller
+    sparql_cache.put(query, query_graph_result or [])
+    return query_graph_result or []
+
+
+async def execute_sparql_query_async(query, status=None):
+    """
+    Runs a SPARQL query on the shared executor, returning [] on error. If status
+    is a dict, 'cache_hit' is set in it. Transport errors are retried with a new
+    client; the backoff between attempts holds neither a DKG slot nor a thread.
+    Cancelling the caller (a discarded speculative query, say) cannot stop a
+    query already running in its thread; it keeps its slot until it finishes,
+    so the slots keep matching the pool leases in use.
+    """
+    try:
+        return await retry_async("dkg", run_in_upstream_slot, "dkg", get_executor(), _cached_or_query, query, status)
+    except Exception as e:
+        print(f"Error during SPARQL query execution: {e}")
+        return []
@@ -0,0 +1,78 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_DIMENSION = 384  # multi-qa-MiniLM-L6-cos-v1
+
+
+def normalize_text(text):
+    # The MiniLM tokenizer is uncased, so case and spacing do not change the embedding
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    LRU cache of question embeddings. Vectors are stored as rows of one preallocated
+    float32 matrix, and get() returns a read-only view of the row rather than a copy.
+    A row is only overwritten after capacity - 1 newer entries have been stored.
+    """
+
+    def __init__(self, capacity=EMBEDDING_CACHE_SIZE, dimension=EMBEDDING_DIMENSION):
+        self.capacity = capacity
+        self.dimension = dimension
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._slots = OrderedDict()  # normalized text -> row index
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text):
+        key = normalize_text(text)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self._slots.move_to_end(key)
+            self.hits += 1
+            view = self._vectors[slot]
+            view.flags.writeable = False
+            return view
+
+    def put(self, text, vector):
+        if self.capacity <= 0:
+            # EMBEDDING_CACHE_SIZE=0 disables the cache
+            return
+        key = normalize_text(text)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    _, slot = self._slots.popitem(last=False)
+                    self.evictions += 1
+                self._slots[key] = slot
+            else:
+                self._slots.move_to_end(key)
+            self._vectors[slot] = vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+embedding_cache = EmbeddingCache()
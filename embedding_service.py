@@ -0,0 +1,84 @@
+import os
+import asyncio
+from shared_resources import get_executor, get_sentence_model
+from embedding_cache import embedding_cache
+
+# How long (milliseconds) the encoder waits to collect concurrent questions into one batch
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "3"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+
+
+def encode_batch(texts):
+    """Returns a float32 numpy matrix with one row per text."""
+    return get_sentence_model().encode(texts, convert_to_numpy=True)
+
+
+class MicroBatchEncoder:
+    """
+    Coalesces questions from concurrent requests into a single sentence_model.encode
+    call. The first question in a batch waits at most window_ms for others to join,
+    then the whole batch is encoded on the shared executor.
+    """
+
+    def __init__(self, encode_fn=encode_batch, window_ms=EMBEDDING_BATCH_WINDOW_MS,
+                 max_batch_size=EMBEDDING_MAX_BATCH_SIZE):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def encode(self, text):
+        """Returns the embedding for one string as a float32 vector."""
+        vector = embedding_cache.get(text)
+        if vector is not None:
+            return vector
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future))
+        vector = await future
+        embedding_cache.put(text, vector)
+        return vector
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # Callers that went away no longer need their embedding
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                vectors = await self._loop.run_in_executor(get_executor(), self.encode_fn, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+embedding_service = MicroBatchEncoder()
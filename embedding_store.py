@@ -0,0 +1,139 @@
+"""
+Content-addressed embedding store on disk, shared by the upload scripts and the
+local vector index. Each model (EMBEDDING_MODEL_ID) has its own directory with
+
+    vectors.f32  float32 rows, append-only
+    keys.bin     sha256 of each row's text, 32 bytes per row, written after the vector
+    meta.json    model id and dimension
+
+A text is embedded at most once per model, so re-running an upload only embeds
+new or changed text, and switching models only computes what that model has not
+seen yet. Readers memory-map vectors.f32, so processes on one host share a
+single copy through the page cache.
+"""
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from shared_resources import EMBEDDING_MODEL_ID
+from embedding_cache import EMBEDDING_DIMENSION
+
+# Relative to this file rather than the working directory, since the upload
+# scripts run from Embeddings/
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Embeddings", "embedding_store"))
+KEY_SIZE = 32  # sha256 digest
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Append-only hash -> vector store for one model. Any number of processes may
+    read while one appends: a row counts once its key is in keys.bin, and its
+    vector is always written first. Writers serialize on a lock file.
+    """
+
+    def __init__(self, model_id=EMBEDDING_MODEL_ID, store_dir=EMBEDDING_STORE_DIR, dimension=EMBEDDING_DIMENSION):
+        self.model_id = model_id
+        self.dimension = dimension
+        self.path = os.path.join(store_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", model_id))
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.keys_path = os.path.join(self.path, "keys.bin")
+        os.makedirs(self.path, exist_ok=True)
+
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if meta.get("model") != model_id or meta.get("dimension") != dimension:
+                raise RuntimeError(f"Embedding store {self.path} holds {meta}, not {model_id} with dimension {dimension}")
+        else:
+            with open(meta_path, 'w') as file:
+                json.dump({"model": model_id, "dimension": dimension}, file)
+        for path in (self.vectors_path, self.keys_path):
+            open(path, 'ab').close()
+
+        self.count = 0
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._rows = {}  # key -> row
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    def refresh(self):
+        """Picks up rows appended since the last refresh, by this or another process."""
+        with open(self.keys_path, 'rb') as file:
+            file.seek(self.count * KEY_SIZE)
+            data = file.read()
+        added = len(data) // KEY_SIZE
+        if not added:
+            return
+        for i in range(added):
+            self._rows.setdefault(data[i * KEY_SIZE:(i + 1) * KEY_SIZE], self.count + i)
+        self.count += added
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.count, self.dimension))
+
+    def lookup(self, texts):
+        """Row of each text, -1 where the store has no vector for it."""
+        return np.array([self._rows.get(text_key(text), -1) for text in texts], dtype=np.int64)
+
+    def add(self, texts, vectors):
+        """Appends vectors for texts the store does not have yet."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension)
+        with self._lock, open(os.path.join(self.path, "write.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            new_keys, new_rows, seen = [], [], set()
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                if key not in self._rows and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(i)
+            if not new_keys:
+                return
+            with open(self.vectors_path, 'r+b') as file:
+                # Drops vectors left without keys by a writer that died between the two appends
+                file.truncate(self.count * self.dimension * 4)
+                file.seek(0, os.SEEK_END)
+                file.write(vectors[new_rows].tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self.keys_path, 'ab') as file:
+                file.write(b"".join(new_keys))
+            self.refresh()
+
+    def matrix(self, rows):
+        """
+        The vectors for rows as a float32 matrix. Consecutive rows are returned as a
+        view of the memory map (shared with other processes); otherwise as a copy.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and rows.min() < 0:
+            raise KeyError("Embedding store has no vector for some of the texts")
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return self.vectors[rows[0]:rows[0] + len(rows)]
+        return np.asarray(self.vectors[rows]) if len(rows) else np.zeros((0, self.dimension), dtype=np.float32)
+
+    def encode(self, texts, encode_fn):
+        """Vectors for texts, calling encode_fn only for (distinct) texts not stored yet."""
+        rows = self.lookup(texts)
+        missing = list(dict.fromkeys(text for text, row in zip(texts, rows) if row < 0))
+        self.hits += len(texts) - int((rows < 0).sum())
+        self.misses += len(missing)
+        if missing:
+            self.add(missing, encode_fn(missing))
+            rows = self.lookup(texts)
+        return np.array(self.matrix(rows))
+
+    def stats(self):
+        return {"rows": self.count, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,165 @@
+"""
+In-process keyword search over the entity export (Embeddings/entitiesMainnet.tsv),
+fused with the EntityCollection vector hits by reciprocal rank fusion.
+
+Two lookups run on the question:
+  - exact: a UAL in the question, or a run of words that is exactly an entity's
+    name or handle (e.g. "0xLuo"), found by dictionary lookup
+  - BM25 over the EntityID, NER, RAG and UAL fields, with EntityID and NER
+    terms weighted higher
+
+Exact matches rank first, then BM25 results. Dense MiniLM similarity is weak on
+names and handles; this recovers them without a bigger model.
+"""
+import os
+import re
+import math
+import asyncio
+import threading
+from dataclasses import replace
+from collections import Counter, defaultdict
+import numpy as np
+from retrieval import SearchHit, ENTITY_COLLECTION
+from reranker import STOPWORDS
+from shared_resources import get_executor
+
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "false").lower() == "true"
+KEYWORD_SEARCH_LIMIT = int(os.getenv("KEYWORD_SEARCH_LIMIT", "20"))
+# Reciprocal rank fusion constant; larger values flatten the difference between ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Term frequency multiplier per field (a simple BM25F)
+FIELD_WEIGHTS = {"EntityID": 3.0, "NER": 2.0, "RAG": 1.0, "UAL": 1.0}
+# Longest name, in words, looked up as an exact match
+MAX_NAME_WORDS = 4
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_UAL_RE = re.compile(r"did:dkg:[^\s'\"<>,;]+", re.IGNORECASE)
+
+
+def terms(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+def name_key(text):
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def entity_names(row):
+    """Names an entity can be asked for by: the end of its EntityID and the leading NER parts."""
+    names = {row["EntityID"].rstrip("/").split("/")[-1].split(":")[-1]}
+    names.update(part for part in (row.get("NER") or "").split(";")[:2])
+    return {key for key in map(name_key, names) if key}
+
+
+class KeywordIndex:
+    """BM25 inverted index plus exact name and UAL lookup over the entity rows."""
+
+    def __init__(self, rows):
+        self.rows = [{"EntityID": row["EntityID"], "RAG": row["RAG"], "UAL": row["UAL"]} for row in rows]
+        self.by_name = defaultdict(list)
+        self.by_ual = defaultdict(list)
+        frequencies, lengths = [], []
+        for doc, row in enumerate(rows):
+            counts = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in terms(row.get(field) or ""):
+                    counts[term] += weight
+            frequencies.append(counts)
+            lengths.append(sum(counts.values()))
+            for name in entity_names(row):
+                self.by_name[name].append(doc)
+            if row.get("UAL"):
+                self.by_ual[row["UAL"].lower()].append(doc)
+
+        # Postings store the length-normalized BM25 term weight, so a query only sums idf * weight
+        average_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+        postings = defaultdict(lambda: ([], []))
+        for doc, counts in enumerate(frequencies):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc] / average_length)
+            for term, tf in counts.items():
+                docs, weights = postings[term]
+                docs.append(doc)
+                weights.append(tf * (BM25_K1 + 1) / (tf + norm))
+        count = len(self.rows)
+        self.postings = {
+            term: (np.array(docs, dtype=np.int32), np.array(weights, dtype=np.float32),
+                   math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)))
+            for term, (docs, weights) in postings.items()
+        }
+
+    def exact(self, question):
+        docs = []
+        for ual in _UAL_RE.findall(question):
+            docs.extend(self.by_ual.get(ual.lower().rstrip(".?!"), ()))
+        words = _TOKEN_RE.findall(question.lower())
+        for size in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                phrase = " ".join(words[start:start + size])
+                # Single stopwords are not names, whatever an entity happens to be called
+                if size == 1 and (phrase in STOPWORDS or len(phrase) < 3):
+                    continue
+                docs.extend(self.by_name.get(phrase, ()))
+        return list(dict.fromkeys(docs))
+
+    def bm25(self, question, limit):
+        scores = {}
+        for term in set(terms(question)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, weights, idf = posting
+            for doc, weight in zip(docs.tolist(), (weights * idf).tolist()):
+                scores[doc] = scores.get(doc, 0.0) + weight
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def search(self, question, limit=KEYWORD_SEARCH_LIMIT):
+        """Exact matches first, then BM25 results, as SearchHits without a vector distance."""
+        docs = list(dict.fromkeys(self.exact(question) + self.bm25(question, limit)))[:limit]
+        return [SearchHit(ENTITY_COLLECTION, doc, None, dict(self.rows[doc])) for doc in docs]
+
+
+def reciprocal_rank_fusion(result_lists, limit, k=RRF_K):
+    """
+    Merges ranked hit lists by summing 1 / (k + rank) per EntityID. A fused hit
+    keeps the fields and distance of its first appearance (vector hits come
+    first) and gets the fused value as its score.
+    """
+    fused, scores = {}, {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            key = hit.get("EntityID") or hit.get("UAL") or hit.id
+            fused.setdefault(key, hit)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    ranked = sorted(fused, key=scores.get, reverse=True)[:limit]
+    return [replace(fused[key], score=scores[key]) for key in ranked]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                # Same source and fields as the local vector index of EntityCollection
+                from local_index import LOCAL_COLLECTIONS, read_tsv
+                _index = KeywordIndex(read_tsv(LOCAL_COLLECTIONS[ENTITY_COLLECTION]["source"]))
+                print(f"Built keyword index over {len(_index.rows)} entities")
+    return _index
+
+
+async def hybrid_entity_hits(question, vector_hits, limit):
+    """The vector hits fused with keyword hits for the question, best limit first."""
+    if _index is None:
+        # Not loaded by warm-up yet; build it off the event loop
+        await asyncio.get_running_loop().run_in_executor(get_executor(), get_index)
+    return reciprocal_rank_fusion([vector_hits, _index.search(question)], limit)
+
+
+def warm_up():
+    if HYBRID_SEARCH_ENABLED:
+        get_index()
@@ -0,0 +1,134 @@
+import os
+import csv
+import sys
+import json
+import hashlib
+import threading
+import numpy as np
+from retrieval import SearchHit
+from embedding_service import encode_batch
+from embedding_store import EmbeddingStore
+from shared_resources import EMBEDDING_MODEL_ID
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "Embeddings/local_index")
+
+# Where each collection's rows come from, which column is embedded and which
+# columns are returned with a hit (mirrors uploadEmbeddingsMainnet.py / uploadQueriesMainnet.py)
+LOCAL_COLLECTIONS = {
+    "EntityCollection": {
+        "source": "Embeddings/entitiesMainnet.tsv",
+        "embed_column": "NER",
+        "fields": lambda row: {"EntityID": row["EntityID"], "RAG": row["RAG"], "UAL": row["UAL"]},
+    },
+    "QueryCollection": {
+        "source": "Embeddings/queriesMainnet.tsv",
+        "embed_column": "query",
+        "fields": lambda row: {"combined": f"question: {row['question']}; query: {row['query']}"},
+    },
+}
+
+
+def read_tsv(path):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline='', encoding='utf-8') as file:
+        return list(csv.DictReader(file, delimiter='\t'))
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalVectorIndex:
+    """
+    Brute-force L2 index over a float32 matrix, usually a view of the memory-mapped
+    embedding store. Distances are squared L2, the same values Milvus reports for
+    metric_type L2, so thresholds carry over.
+    """
+
+    def __init__(self, collection_name, vectors, rows):
+        self.collection_name = collection_name
+        self.vectors = vectors
+        self.rows = rows
+        self.norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    def search(self, query_embedding, limit):
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        distances = self.norms - 2 * (self.vectors @ query) + float(query @ query)
+        limit = min(limit, len(distances))
+        if limit <= 0:
+            return []
+        top = np.argpartition(distances, limit - 1)[:limit]
+        top = top[np.argsort(distances[top])]
+        return [SearchHit(self.collection_name, int(i), float(max(distances[i], 0.0)), dict(self.rows[i])) for i in top]
+
+
+def build_index(collection_name, encode_fn, store, index_dir=LOCAL_INDEX_DIR):
+    """
+    Embeds the collection's TSV into the embedding store (only text it does not
+    have yet) and writes <name>.json with the rows and their store rows to index_dir.
+    """
+    spec = LOCAL_COLLECTIONS[collection_name]
+    rows = read_tsv(spec["source"])
+    texts = [row[spec["embed_column"]] for row in rows]
+    store.encode(texts, encode_fn)
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, f"{collection_name}.json"), 'w') as file:
+        json.dump({
+            "source_sha256": _file_sha256(spec["source"]),
+            "model": store.model_id,
+            "store_rows": store.lookup(texts).tolist(),
+            "rows": [spec["fields"](row) for row in rows],
+        }, file)
+    print(f"Built local index for {collection_name} with {len(rows)} rows")
+
+
+def load_index(collection_name, encode_fn, index_dir=LOCAL_INDEX_DIR, model_name=EMBEDDING_MODEL_ID):
+    """
+    Maps the collection's vectors from the embedding store, rebuilding its
+    index first if the TSV or model changed.
+    """
+    spec = LOCAL_COLLECTIONS[collection_name]
+    store = EmbeddingStore(model_name)
+    meta_path = os.path.join(index_dir, f"{collection_name}.json")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+        # Also rebuilt when the store lost rows (e.g. its directory was deleted)
+        if (meta.get("source_sha256") != _file_sha256(spec["source"]) or meta.get("model") != model_name
+                or "store_rows" not in meta or max(meta["store_rows"], default=-1) >= len(store)):
+            meta = None
+    if meta is None:
+        build_index(collection_name, encode_fn, store, index_dir)
+        with open(meta_path) as file:
+            meta = json.load(file)
+    return LocalVectorIndex(collection_name, store.matrix(meta["store_rows"]), meta["rows"])
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(collection_name):
+    index = _indexes.get(collection_name)
+    if index is None:
+        with _lock:
+            index = _indexes.get(collection_name)
+            if index is None:
+                index = load_index(collection_name, encode_batch)
+                _indexes[collection_name] = index
+    return index
+
+
+def search(collection_name, query_embedding, limit):
+    return get_index(collection_name).search(query_embedding, limit)
+
+
+def load_all():
+    """Loads (building if needed) every local collection, e.g. during startup."""
+    for collection_name in LOCAL_COLLECTIONS:
+        get_index(collection_name)
@@ -0,0 +1,140 @@
+import time
+import inspect
+import functools
+import threading
+
+# Seconds; chosen to resolve both sub-millisecond cache hits and multi-second GPT-4 calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with a fixed set of label names."""
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            for i, bound in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', repr(float(bound))))} {series[i]}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+_registry = []
+
+STAGE_LATENCY = Histogram(
+    "chatdkg_stage_duration_seconds",
+    "Time spent in each query pipeline stage.",
+    ("stage",),
+)
+SEARCH_LATENCY = Histogram(
+    "chatdkg_vector_search_duration_seconds",
+    "Time spent in one vector search, per collection.",
+    ("collection",),
+)
+FUNCTION_LATENCY = Histogram(
+    "chatdkg_function_duration_seconds",
+    "Execution time of functions decorated with timed_function.",
+    ("function",),
+)
+REQUEST_LATENCY = Histogram(
+    "chatdkg_http_request_duration_seconds",
+    "End-to-end HTTP request latency.",
+    ("method", "path", "status"),
+)
+
+
+class span:
+    """
+    Times a block of sync or async code:
+
+        with span("llm", context["timings"]):
+            response = await ...
+
+    The duration is observed in the stage histogram and, if a timings dict is
+    given, also stored in it under the stage name.
+    """
+
+    def __init__(self, stage, timings=None, histogram=STAGE_LATENCY, label="stage"):
+        self.stage = stage
+        self.timings = timings
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **{self.label: self.stage})
+        if self.timings is not None:
+            self.timings[self.stage] = self.elapsed
+        return False
+
+
+def timed_function(func):
+    """Decorator to measure execution time of a function. Awaits coroutine functions."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(func.__name__, histogram=FUNCTION_LATENCY, label="function"):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__, histogram=FUNCTION_LATENCY, label="function"):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def render_gauges(name, documentation, values, label_name):
+    """Prometheus text for a gauge with one sample per label value in values."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for label_value, value in values.items():
+        lines.append(f"{name}{_format_labels((label_name,), (label_value,))} {value}")
+    return lines
+
+
+def render_metrics(extra_lines=()):
+    """Every registered histogram, plus extra_lines, in the Prometheus text format."""
+    lines = []
+    for histogram in _registry:
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
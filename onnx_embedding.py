@@ -0,0 +1,228 @@
+"""
+CPU embedding backend that runs the sentence-transformers model through ONNX
+Runtime instead of PyTorch, optionally with int8 dynamic quantization.
+
+Export once (needs torch and sentence-transformers; the server then only needs
+onnxruntime and tokenizers):
+
+    python onnx_embedding.py [output_dir]
+
+and select it with EMBEDDING_BACKEND=onnx or EMBEDDING_BACKEND=onnx-int8. The
+export encodes a sample of the corpus with both backends and records the lowest
+cosine similarity per variant; a variant below EMBEDDING_COSINE_TOLERANCE is
+refused at load time.
+"""
+import os
+import csv
+import sys
+import json
+import numpy as np
+from shared_resources import MODEL_NAME
+
+# Relative to this file rather than the working directory, since the upload
+# scripts run from Embeddings/
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Embeddings", "onnx_model"))
+# Lowest acceptable cosine similarity between an ONNX vector and the torch vector for the same text
+EMBEDDING_COSINE_TOLERANCE = float(os.getenv("EMBEDDING_COSINE_TOLERANCE", "0.99"))
+# 0 lets onnxruntime use every core; set lower when several workers share a host
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "0"))
+ONNX_BATCH_SIZE = 32
+
+MODEL_FILES = {"fp32": "model.onnx", "int8": "model-int8.onnx"}
+METADATA_FILE = "metadata.json"
+
+# Texts used for the tolerance check when the corpus files are not available
+FALLBACK_VERIFICATION_TEXTS = [
+    "Who are the investors in renewable energy projects?",
+    "Find organizations working on carbon capture",
+    "What is the UAL of the knowledge asset about regenerative agriculture?",
+    "List people who founded a startup in Berlin",
+    "SELECT ?name WHERE { ?org schema:name ?name }",
+]
+
+
+def verification_texts(limit=200):
+    """Questions and entity NER strings from the Embeddings TSVs, the same text the server embeds."""
+    embeddings_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Embeddings")
+    texts = []
+    for file_name, column in (("queriesMainnet.tsv", "question"), ("queriesMainnet.tsv", "query"), ("entitiesMainnet.tsv", "NER")):
+        path = os.path.join(embeddings_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file, delimiter='\t'):
+                if row.get(column):
+                    texts.append(row[column])
+                if len(texts) >= limit * 3:
+                    break
+    # Spread the sample over all three sources
+    return texts[::3][:limit] or FALLBACK_VERIFICATION_TEXTS
+
+
+class OnnxSentenceEncoder:
+    """
+    Stand-in for SentenceTransformer.encode backed by an ONNX Runtime session:
+    tokenize, run the transformer, pool, normalize. Returns float32 numpy arrays.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, variant="int8", tolerance=EMBEDDING_COSINE_TOLERANCE,
+                 num_threads=ONNX_NUM_THREADS, check=True):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        metadata_path = os.path.join(model_dir, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise RuntimeError(f"No exported ONNX model in {model_dir}; run 'python onnx_embedding.py' first")
+        with open(metadata_path) as file:
+            self.metadata = json.load(file)
+        if check:
+            if self.metadata.get("model") != MODEL_NAME:
+                raise RuntimeError(f"ONNX model in {model_dir} was exported from {self.metadata.get('model')}, not {MODEL_NAME}")
+            min_cosine = self.metadata.get("min_cosine", {}).get(variant)
+            if min_cosine is None or min_cosine < tolerance:
+                raise RuntimeError(f"ONNX {variant} model is not within the cosine tolerance "
+                                   f"({min_cosine} < {tolerance}); re-export or use another backend")
+
+        self.pooling = self.metadata.get("pooling", "mean")
+        self.normalize = self.metadata.get("normalize", True)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.metadata.get("max_seq_length", 512))
+        self.tokenizer.enable_padding(pad_id=self.metadata.get("pad_token_id", 0), pad_token=self.metadata.get("pad_token", "[PAD]"))
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        # Without the arena, memory for a large batch is returned afterwards instead of held for the worker's lifetime
+        options.enable_cpu_mem_arena = False
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, MODEL_FILES[variant]), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode_chunk(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts, batch_size=ONNX_BATCH_SIZE, convert_to_numpy=True, convert_to_tensor=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.metadata.get("dimension", 384)), dtype=np.float32)
+        # Batch texts of similar length together so padding stays small
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        vectors = np.empty((len(texts), self.metadata.get("dimension", 384)), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            indices = order[start:start + batch_size]
+            vectors[indices] = self._encode_chunk([texts[i] for i in indices])
+        return vectors[0] if single else vectors
+
+
+def cosine_similarities(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def _pooling_mode(pooling):
+    if pooling is None:
+        return "mean"
+    config = pooling.get_config_dict()
+    # sentence-transformers >= 6 stores the mode as a string, older versions as flags
+    mode = config.get("pooling_mode") or ("cls" if config.get("pooling_mode_cls_token") else "mean")
+    if mode not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode for the ONNX backend: {mode}")
+    return mode
+
+
+def export_onnx_model(model_name=MODEL_NAME, output_dir=ONNX_MODEL_DIR, quantize=True, texts=None):
+    """
+    Exports the transformer of a sentence-transformers model to ONNX (and an int8
+    copy), then checks both against the torch vectors and writes metadata.json.
+    Returns the metadata.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    reference = SentenceTransformer(model_name, device="cpu")
+    transformer = reference[0].auto_model.eval()
+    tokenizer = reference.tokenizer
+    pooling = next((module for module in reference if isinstance(module, Pooling)), None)
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(output_dir, MODEL_FILES["fp32"])
+
+    class TokenEmbeddings(torch.nn.Module):
+        # The exporter passes the inputs positionally; they are mapped to keyword arguments by
+        # name, since the positional order of the transformer's forward() differs between versions
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(), tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14, dynamo=False,
+        )
+    variants = ["fp32"]
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(output_dir, MODEL_FILES["int8"]), weight_type=QuantType.QInt8)
+        variants.append("int8")
+
+    metadata = {
+        "model": model_name,
+        "dimension": reference.get_sentence_embedding_dimension(),
+        "max_seq_length": reference.max_seq_length,
+        "pooling": _pooling_mode(pooling),
+        "normalize": any(isinstance(module, Normalize) for module in reference),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "min_cosine": {},
+        "mean_cosine": {},
+    }
+    with open(os.path.join(output_dir, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2)
+
+    texts = texts or verification_texts()
+    expected = reference.encode(texts, convert_to_numpy=True)
+    for variant in variants:
+        encoder = OnnxSentenceEncoder(output_dir, variant=variant, check=False)
+        similarities = cosine_similarities(expected, encoder.encode(texts))
+        metadata["min_cosine"][variant] = float(similarities.min())
+        metadata["mean_cosine"][variant] = float(similarities.mean())
+        status = "ok" if similarities.min() >= EMBEDDING_COSINE_TOLERANCE else "BELOW TOLERANCE"
+        print(f"{variant}: cosine vs torch over {len(texts)} texts min {similarities.min():.5f} "
+              f"mean {similarities.mean():.5f} ({status})")
+
+    with open(os.path.join(output_dir, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+if __name__ == "__main__":
+    export_onnx_model(output_dir=sys.argv[1] if len(sys.argv) > 1 else ONNX_MODEL_DIR)
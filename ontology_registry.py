@@ -0,0 +1,204 @@
+import os
+import re
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List
+
+ONTOLOGY_FILE_PATH = "Ontology/ontology.ttl"
+
+# How often (seconds) the background watcher checks the ontology file for changes
+ONTOLOGY_CHECK_INTERVAL = float(os.getenv("ONTOLOGY_CHECK_INTERVAL", "30"))
+
+_UNION_RE = re.compile(r"owl:unionOf\s*\(([^)]*)\)")
+
+
+@dataclass(frozen=True)
+class OntologySnapshot:
+    """Parsed view of the ontology file, built once per file version."""
+    content: str
+    sparql_prefixes: str
+    classes: List[str] = field(default_factory=list)
+    properties: Dict[str, Dict[str, List[str]]] = field(default_factory=dict)
+    # Property name -> its one-line summary, and the words that make it relevant
+    fragments: Dict[str, str] = field(default_factory=dict)
+    fragment_terms: Dict[str, FrozenSet[str]] = field(default_factory=dict)
+    ttl_prefixes: str = ""
+    mtime: float = 0.0
+    sha256: str = ""
+
+    def select_fragment(self, text):
+        """
+        Returns a reduced ontology for the prompt: the prefixes, the class list and
+        only the properties whose name or domain/range classes occur in text.
+        Falls back to every property if none match.
+        """
+        words = text_terms(text)
+        selected = [name for name, terms in self.fragment_terms.items() if terms & words] or list(self.fragments)
+        lines = [self.ttl_prefixes, "Classes: " + ", ".join(self.classes)]
+        lines.extend(self.fragments[name] for name in selected)
+        return "\n".join(lines)
+
+
+def extract_prefixes(ontology_content):
+    # Extract prefixes like '@prefix schema: <http://schema.org/> .'
+    lines = ontology_content.split("\n")
+    prefix_lines = [line for line in lines if line.startswith("@prefix")]
+    sparl_prefixes = []
+
+    for line in prefix_lines:
+        # Remove the '.' at the end and split
+        parts = line.rstrip('.').split()
+        if len(parts) >= 3:
+            # Convert '@prefix' to 'PREFIX'
+            prefix = parts[1]
+            uri = parts[2]
+            sparl_prefix = f"PREFIX {prefix} {uri}"
+            sparl_prefixes.append(sparl_prefix)
+
+    return "\n".join(sparl_prefixes)
+
+
+def _parse_range(statement):
+    match = re.search(r"rdfs:range\s+(\[[^\]]*\]|\S+)", statement)
+    if not match:
+        return []
+    value = match.group(1)
+    union = _UNION_RE.search(value)
+    if union:
+        return union.group(1).split()
+    return [value.rstrip(";.")]
+
+
+def text_terms(text):
+    """
+    Lower-cased words of text with camelCase split. Each word also contributes a
+    crude stem (plural 's' dropped, long words cut to 6 letters) so that e.g.
+    'invested' and 'investor' meet on 'invest'.
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    terms = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        terms.add(word)
+        if len(word) > 3 and word.endswith("s"):
+            terms.add(word[:-1])
+        if len(word) > 6:
+            terms.add(word[:6])
+    return terms
+
+
+def _local_name(term):
+    return term.split(":")[-1]
+
+
+def parse_classes_and_properties(ontology_content):
+    """
+    Returns (classes, properties) from the ontology. Statements are split on the
+    terminating ' .' the way RDFtoOWL.py / KnowledgeAssetsToOWL.py write them.
+    """
+    classes = []
+    properties = {}
+    body = "\n".join(line for line in ontology_content.split("\n") if not line.startswith("@prefix"))
+    for statement in re.split(r"\s\.\s*\n", body + "\n"):
+        statement = statement.strip()
+        if not statement:
+            continue
+        subject = statement.split()[0]
+        if re.match(r"^\S+\s+a\s+owl:Class\b", statement):
+            classes.append(subject)
+        elif re.match(r"^\S+\s+a\s+owl:(Object|Datatype)Property\b", statement):
+            domain = re.search(r"rdfs:domain\s*\[[^\]]*owl:unionOf\s*\(([^)]*)\)", statement)
+            properties[subject] = {
+                "domain": domain.group(1).split() if domain else [],
+                "range": _parse_range(statement),
+            }
+    return classes, properties
+
+
+def summarize_property(name, info):
+    return f"{name} (domain: {' | '.join(info['domain']) or 'any'}; range: {' | '.join(info['range']) or 'any'})"
+
+
+def build_snapshot(content, mtime=0.0, sha256=""):
+    classes, properties = parse_classes_and_properties(content)
+    fragments = {}
+    fragment_terms = {}
+    for name, info in properties.items():
+        fragments[name] = summarize_property(name, info)
+        related = [name] + [term for term in info["domain"] + info["range"] if not term.startswith("xsd:")]
+        fragment_terms[name] = frozenset(text_terms(" ".join(_local_name(term) for term in related)))
+    return OntologySnapshot(
+        content=content,
+        sparql_prefixes=extract_prefixes(content),
+        classes=classes,
+        properties=properties,
+        fragments=fragments,
+        fragment_terms=fragment_terms,
+        ttl_prefixes="\n".join(line for line in content.split("\n") if line.startswith("@prefix")),
+        mtime=mtime,
+        sha256=sha256,
+    )
+
+
+class OntologyRegistry:
+    """
+    Holds the parsed ontology in memory. Readers get the current snapshot without
+    touching the disk; the file is only re-read when its mtime changes and only
+    re-parsed when its content hash changes.
+    """
+
+    def __init__(self, file_path=ONTOLOGY_FILE_PATH, check_interval=ONTOLOGY_CHECK_INTERVAL):
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def get(self) -> OntologySnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def refresh(self) -> OntologySnapshot:
+        """Reload the file if it changed since the last load. Returns the current snapshot."""
+        with self._lock:
+            mtime = os.stat(self.file_path).st_mtime
+            if self._snapshot is not None and self._snapshot.mtime == mtime:
+                return self._snapshot
+            with open(self.file_path, 'rb') as file:
+                raw = file.read()
+            sha256 = hashlib.sha256(raw).hexdigest()
+            if self._snapshot is not None and self._snapshot.sha256 == sha256:
+                # Touched but unchanged; just remember the new mtime
+                self._snapshot = OntologySnapshot(**{**self._snapshot.__dict__, "mtime": mtime})
+            else:
+                self._snapshot = build_snapshot(raw.decode("utf-8"), mtime, sha256)
+                print(f"Loaded ontology {self.file_path} ({len(self._snapshot.classes)} classes, {len(self._snapshot.properties)} properties)")
+            return self._snapshot
+
+    def start_watching(self):
+        """Start a daemon thread that periodically checks the file for changes."""
+        self.get()
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="ontology-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=self.check_interval)
+            self._watcher = None
+
+    def _watch(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error reloading ontology: {e}")
+
+
+ontology_registry = OntologyRegistry()
@@ -0,0 +1,81 @@
+import os
+import re
+
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+# Longest RAG text (characters) kept for a single entity match
+PROMPT_MAX_RAG_CHARS = int(os.getenv("PROMPT_MAX_RAG_CHARS", "800"))
+# Approximate token budgets for the entity and query matches sections of the prompt
+PROMPT_ENTITY_TOKEN_BUDGET = int(os.getenv("PROMPT_ENTITY_TOKEN_BUDGET", "1200"))
+PROMPT_QUERY_TOKEN_BUDGET = int(os.getenv("PROMPT_QUERY_TOKEN_BUDGET", "1200"))
+
+_TYPE_RE = re.compile(r"\btype:\s*([A-Za-z]+)")
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text with the GPT-4 tokenizer
+    return (len(text) + 3) // 4
+
+
+def truncate_text(text, max_chars):
+    if not isinstance(text, str) or len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    # Prefer ending on a field boundary of the '; '-separated RAG text
+    boundary = cut.rfind("; ")
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut + " ..."
+
+
+def compact_entity_matches(entity_matches, max_rag_chars=PROMPT_MAX_RAG_CHARS, token_budget=PROMPT_ENTITY_TOKEN_BUDGET):
+    """
+    Returns the entity matches to put in the prompt, in rank order, with long RAG
+    fields truncated and lower-ranked matches dropped once the budget is spent.
+    The best match is always kept.
+    """
+    compacted = []
+    used = 0
+    for match in entity_matches:
+        match = dict(match)
+        if "RAG" in match:
+            match["RAG"] = truncate_text(match["RAG"], max_rag_chars)
+        cost = estimate_tokens(str(match))
+        if compacted and used + cost > token_budget:
+            break
+        compacted.append(match)
+        used += cost
+    return compacted
+
+
+def compact_query_matches(query_matches, token_budget=PROMPT_QUERY_TOKEN_BUDGET):
+    """Keeps whole query matches (SPARQL must not be cut) in rank order within the budget."""
+    compacted = []
+    used = 0
+    for match in query_matches:
+        cost = estimate_tokens(str(match))
+        if compacted and used + cost > token_budget:
+            break
+        compacted.append(match)
+        used += cost
+    return compacted
+
+
+def ontology_selection_text(question, entity_matches):
+    """The question plus the entity types of the matches, used to pick ontology fragments."""
+    types = []
+    for match in entity_matches:
+        rag = match.get("RAG") if hasattr(match, "get") else None
+        if isinstance(rag, str):
+            types.extend(_TYPE_RE.findall(rag[:200]))
+    return " ".join([question] + types)
+
+
+def build_prompt_inputs(question, query_matches, entity_matches, ontology):
+    """
+    Returns (query_matches, entity_matches, ontology_text) for
+    extract_entities_and_classify, reduced to what is relevant to the question.
+    """
+    if not PROMPT_COMPACTION_ENABLED:
+        return query_matches, entity_matches, ontology.content
+    ontology_text = ontology.select_fragment(ontology_selection_text(question, entity_matches))
+    return compact_query_matches(query_matches), compact_entity_matches(entity_matches), ontology_text
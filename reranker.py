@@ -0,0 +1,139 @@
+"""
+Optional reranking of EntityCollection hits before they go into the GPT-4 prompt.
+The entity search over-fetches RERANK_CANDIDATES hits, they are rescored in one
+batch, and only the best RERANK_TOP_N scoring at least RERANK_MIN_SCORE are kept.
+
+    RERANKER=hybrid         retrieval score blended with question-term overlap; no model
+    RERANKER=cross-encoder  CROSS_ENCODER_MODEL scores each (question, entity) pair on CPU
+
+Cross-encoder scoring runs on its own single-thread executor, so it never takes
+pipeline workers; if it takes longer than RERANK_BUDGET_MS the hits keep their
+vector order instead (counted as over_budget in the rerank metrics).
+"""
+import os
+import re
+import math
+import asyncio
+import threading
+import concurrent.futures
+from dataclasses import replace
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANKER = os.getenv("RERANKER", "hybrid").lower()
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+# Hybrid and cross-encoder scores are both in [0, 1]; unset keeps the top N whatever their score
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE")) if os.getenv("RERANK_MIN_SCORE") else None
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+# Share of the hybrid score that comes from term overlap rather than vector similarity
+RERANK_LEXICAL_WEIGHT = float(os.getenv("RERANK_LEXICAL_WEIGHT", "0.3"))
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Characters of each entity's RAG text that are scored
+RERANK_MAX_TEXT_CHARS = 1000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a about all an and any are as at be by can did do does find for from give has have how in is it its list "
+    "many me much of on or show tell that the their there these this those to was were what which who with".split()
+)
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+_scoring_executor = None
+
+stats = {"reranked": 0, "over_budget": 0, "below_threshold": 0}
+
+
+def tokenize(text):
+    return {token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS}
+
+
+def candidate_text(hit):
+    return f"{hit.get('EntityID') or ''}; {(hit.get('RAG') or '')[:RERANK_MAX_TEXT_CHARS]}"
+
+
+def retrieval_scores(hits):
+    """
+    How well the search ranked each hit, in [0, 1]. Hits from keyword fusion use
+    their fused score relative to the best one, since keyword-only hits have no
+    vector distance; plain vector hits use cosine similarity.
+    """
+    if hits and all(hit.score is not None for hit in hits):
+        best = max(hit.score for hit in hits) or 1.0
+        return [hit.score / best for hit in hits]
+    # Squared L2 between unit vectors is 2 - 2 * cosine
+    return [max(0.0, 1.0 - hit.distance / 2) if hit.distance is not None else 0.0 for hit in hits]
+
+
+def hybrid_scores(question, hits, lexical_weight=RERANK_LEXICAL_WEIGHT):
+    """
+    (1 - w) * retrieval score + w * the idf-weighted share of question terms the
+    entity contains. idf is taken over the candidates, so a term every candidate
+    shares adds little.
+    """
+    terms = tokenize(question)
+    documents = [tokenize(candidate_text(hit)) for hit in hits]
+    idf = {term: math.log(1 + len(documents) / (1 + sum(term in document for document in documents))) for term in terms}
+    total = sum(idf.values()) or 1.0
+    scores = []
+    for retrieval, document in zip(retrieval_scores(hits), documents):
+        lexical = sum(idf[term] for term in terms & document) / total
+        scores.append((1 - lexical_weight) * retrieval + lexical_weight * lexical)
+    return scores
+
+
+def get_cross_encoder():
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, device="cpu", max_length=256)
+    return _cross_encoder
+
+
+def get_scoring_executor():
+    global _scoring_executor
+    if _scoring_executor is None:
+        with _cross_encoder_lock:
+            if _scoring_executor is None:
+                # One thread: the model already uses every core for a batch
+                _scoring_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+    return _scoring_executor
+
+
+def cross_encoder_scores(question, hits):
+    # One batch for all candidates; single-label cross-encoders return sigmoid scores
+    pairs = [(question, candidate_text(hit)) for hit in hits]
+    return [float(score) for score in get_cross_encoder().predict(pairs, batch_size=len(pairs), convert_to_numpy=True)]
+
+
+def select(hits, scores, top_n=RERANK_TOP_N, min_score=RERANK_MIN_SCORE):
+    """The top_n hits by score with at least min_score, with their score set."""
+    ranked = sorted(zip(hits, scores), key=lambda pair: pair[1], reverse=True)
+    kept = [replace(hit, score=score) for hit, score in ranked if min_score is None or score >= min_score]
+    stats["below_threshold"] += len(ranked) - len(kept)
+    return kept[:top_n]
+
+
+async def rerank(question, hits, top_n=RERANK_TOP_N, min_score=RERANK_MIN_SCORE, budget_ms=RERANK_BUDGET_MS):
+    """Rescores over-fetched entity hits and returns the ones to put in the prompt."""
+    if not hits:
+        return hits
+    stats["reranked"] += 1
+    if RERANKER != "cross-encoder":
+        return select(hits, hybrid_scores(question, hits), top_n, min_score)
+    loop = asyncio.get_running_loop()
+    scoring = loop.run_in_executor(get_scoring_executor(), cross_encoder_scores, question, hits)
+    try:
+        scores = await asyncio.wait_for(scoring, budget_ms / 1000) if budget_ms > 0 else await scoring
+    except asyncio.TimeoutError:
+        stats["over_budget"] += 1
+        return hits[:top_n]
+    return select(hits, scores, top_n, min_score)
+
+
+def warm_up():
+    """Loads the cross-encoder, so the first requests do not spend their budget on it."""
+    if RERANK_ENABLED and RERANKER == "cross-encoder":
+        get_cross_encoder()
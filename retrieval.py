@@ -0,0 +1,190 @@
+import os
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from shared_resources import get_executor, get_milvus_client
+from metrics import span, SEARCH_LATENCY
+from concurrency import retry_call, retry_async, run_in_upstream_slot
+
+ENTITY_COLLECTION = "EntityCollection"
+QUERY_COLLECTION = "QueryCollection"
+
+
+def _optional_float(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+# Per-collection search configuration. max_distance drops hits whose L2 distance
+# is above the threshold; None keeps every hit up to limit.
+SEARCH_CONFIG = {
+    ENTITY_COLLECTION: {
+        "limit": int(os.getenv("ENTITY_SEARCH_LIMIT", "5")),
+        "output_fields": ["EntityID", "RAG", "UAL"],
+        "search_params": {"metric_type": "L2", "params": {"nprobe": int(os.getenv("ENTITY_SEARCH_NPROBE", "10"))}},
+        "max_distance": _optional_float("ENTITY_MAX_DISTANCE"),
+    },
+    QUERY_COLLECTION: {
+        "limit": int(os.getenv("QUERY_SEARCH_LIMIT", "5")),
+        "output_fields": ["combined"],
+        "search_params": {"metric_type": "L2", "params": {"nprobe": int(os.getenv("QUERY_SEARCH_NPROBE", "10"))}},
+        "max_distance": _optional_float("QUERY_MAX_DISTANCE"),
+    },
+}
+
+# "milvus" searches the hosted collections; "local" searches an in-process index built
+# from the Embeddings/*.tsv files (see local_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus").lower()
+
+USE_ASYNC_MILVUS = os.getenv("USE_ASYNC_MILVUS", "true").lower() == "true"
+
+
+@dataclass
+class SearchHit:
+    """
+    One search result. distance is the L2 distance (lower is closer), None for
+    hits found only by keyword search; score is set by keyword fusion or the
+    reranker (higher is better).
+    """
+    collection: str
+    id: Any
+    distance: Optional[float]
+    fields: Dict[str, Any] = field(default_factory=dict)
+    score: Optional[float] = None
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+
+def to_search_hits(collection_name, raw_hits):
+    hits = []
+    for raw in raw_hits:
+        if hasattr(raw, "get"):
+            fields = raw.get("entity") or {k: v for k, v in raw.items() if k not in ("id", "distance")}
+            hit_id, distance = raw.get("id"), raw.get("distance")
+        else:
+            fields = getattr(raw, "entity", {}) or {}
+            hit_id, distance = getattr(raw, "id", None), getattr(raw, "distance", None)
+        # A missing distance stays None rather than reading as an exact match
+        hits.append(SearchHit(collection_name, hit_id, float(distance) if distance is not None else None, dict(fields)))
+    return hits
+
+
+def apply_threshold(hits, max_distance):
+    if max_distance is None:
+        return hits
+    # Hits without a distance cannot be measured against the threshold and are kept,
+    # as keyword-only hits are
+    return [hit for hit in hits if hit.distance is None or hit.distance <= max_distance]
+
+
+def search_collection(collection_name, query_embedding, milvus_client=None, config=None) -> List[SearchHit]:
+    """Blocking search of one collection with the synchronous MilvusClient."""
+    config = config or SEARCH_CONFIG[collection_name]
+    if VECTOR_BACKEND == "local":
+        return search_local(collection_name, query_embedding, config)
+    try:
+        return retry_call("milvus", _search_milvus, collection_name, query_embedding, milvus_client, config)
+    except Exception as e:
+        print(f"Error during Milvus similarity search: {e}")
+        return []
+
+
+def _search_milvus(collection_name, query_embedding, milvus_client, config):
+    # One attempt; errors are raised for the caller to retry
+    res = (milvus_client or get_milvus_client()).search(
+        collection_name=collection_name,
+        data=[query_embedding],
+        output_fields=config["output_fields"],
+        limit=config["limit"],
+        search_params=config["search_params"],
+    )
+    return apply_threshold(to_search_hits(collection_name, res[0]), config["max_distance"])
+
+
+def search_local(collection_name, query_embedding, config):
+    import local_index
+    hits = local_index.search(collection_name, query_embedding, config["limit"])
+    return apply_threshold(hits, config["max_distance"])
+
+
+_async_client = None
+_async_client_loop = None
+_async_client_class = None
+
+
+def _get_async_client_class():
+    # Imported on first search rather than at import time; False if unavailable
+    global _async_client_class
+    if _async_client_class is None:
+        try:
+            from pymilvus import AsyncMilvusClient
+            _async_client_class = AsyncMilvusClient
+        except ImportError:  # pymilvus < 2.5 has no asyncio client
+            _async_client_class = False
+    return _async_client_class
+
+
+def get_async_milvus_client():
+    # The asyncio client's channel belongs to the loop that created it
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = _get_async_client_class()(
+            uri=os.getenv("MILVUS_URI_MAINNET"),
+            token=os.getenv("MILVUS_TOKEN_MAINNET"),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def search_collection_async(collection_name, query_embedding, config=None) -> List[SearchHit]:
+    config = config or SEARCH_CONFIG[collection_name]
+    loop = asyncio.get_running_loop()
+    if VECTOR_BACKEND == "local":
+        # The scan is numpy work; keep it off the event loop
+        return await loop.run_in_executor(get_executor(), search_local, collection_name, query_embedding, config)
+    try:
+        if not USE_ASYNC_MILVUS or not _get_async_client_class():
+            # Each attempt takes a slot and a thread; the backoff between attempts takes neither
+            return await retry_async(
+                "milvus", run_in_upstream_slot, "milvus", get_executor(),
+                _search_milvus, collection_name, query_embedding, None, config,
+            )
+        res = await retry_async(
+            "milvus", get_async_milvus_client().search,
+            slot="milvus",
+            collection_name=collection_name,
+            data=[query_embedding],
+            output_fields=config["output_fields"],
+            limit=config["limit"],
+            search_params=config["search_params"],
+        )
+        return apply_threshold(to_search_hits(collection_name, res[0]), config["max_distance"])
+    except Exception as e:
+        print(f"Error during Milvus similarity search: {e}")
+        return []
+
+
+async def _timed_search(collection_name, query_embedding, config=None):
+    with span(collection_name, histogram=SEARCH_LATENCY, label="collection"):
+        return await search_collection_async(collection_name, query_embedding, config)
+
+
+async def search_all(query_embedding, collection_names=(ENTITY_COLLECTION, QUERY_COLLECTION), limits=None) -> Dict[str, List[SearchHit]]:
+    """Searches every collection concurrently with the same embedding. limits overrides the configured limit per collection."""
+    limits = limits or {}
+    configs = [dict(SEARCH_CONFIG[name], limit=limits[name]) if name in limits else None for name in collection_names]
+    results = await asyncio.gather(*[_timed_search(name, query_embedding, config) for name, config in zip(collection_names, configs)])
+    return dict(zip(collection_names, results))
+
+
+async def close():
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        try:
+            await _async_client.close()
+        except Exception as e:
+            print(f"Error closing async Milvus client: {e}")
+        _async_client = None
+        _async_client_loop = None
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+# Minimum cosine similarity between two questions for a cached answer to be reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Cached answers older than this many seconds are discarded
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# Approximate memory budget for cached answers plus their embeddings
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv("SEMANTIC_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+
+def entity_match_keys(entity_matches):
+    """Identity of a set of entity matches, in rank order."""
+    keys = []
+    for match in entity_matches:
+        if hasattr(match, "get"):
+            keys.append(match.get("EntityID") or match.get("UAL") or str(match))
+        else:
+            keys.append(str(match))
+    return tuple(keys)
+
+
+class SemanticAnswerCache:
+    """
+    Cache of extract_entities_and_classify results looked up by question embedding.
+    Embeddings live in a preallocated float32 matrix so a lookup is one matrix-vector
+    product; an entry is only reused when the retrieved entity matches are identical.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                 max_bytes=SEMANTIC_CACHE_MAX_BYTES, max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._vectors = None
+        self._active = np.zeros(max_entries, dtype=bool)
+        self._slots = [None] * max_entries
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, entity_matches):
+        """Returns a cached response for a similar question with the same entity matches, or None."""
+        with self._lock:
+            if self._vectors is None or not self._active.any():
+                self.misses += 1
+                return None
+            self._expire()
+            query = self._normalize(embedding)
+            similarities = self._vectors @ query
+            similarities[~self._active] = -1.0
+            keys = entity_match_keys(entity_matches)
+            for slot in np.argsort(-similarities):
+                if similarities[slot] < self.threshold:
+                    break
+                entry = self._slots[slot]
+                if entry["entity_keys"] == keys:
+                    self.hits += 1
+                    return entry["response"]
+            self.misses += 1
+            return None
+
+    def store(self, embedding, entity_matches, response):
+        vector = self._normalize(embedding)
+        size = vector.nbytes + len(json.dumps(response, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._expire()
+            while self._bytes + size > self.max_bytes or self._active.all():
+                if not self._evict_oldest():
+                    # Nothing left to evict (max_entries=0): the response is not stored
+                    return
+            slot = int(np.argmin(self._active))
+            self._vectors[slot] = vector
+            self._active[slot] = True
+            self._slots[slot] = {
+                "entity_keys": entity_match_keys(entity_matches),
+                "response": response,
+                "created_at": time.monotonic(),
+                "size": size,
+            }
+            self._bytes += size
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for slot in np.flatnonzero(self._active):
+            if self._slots[slot]["created_at"] < cutoff:
+                self._remove(slot)
+
+    def _evict_oldest(self):
+        """Removes the oldest entry; False if the cache is empty."""
+        active = np.flatnonzero(self._active)
+        if not len(active):
+            return False
+        oldest = min(active, key=lambda slot: self._slots[slot]["created_at"])
+        self._remove(oldest)
+        self.evictions += 1
+        return True
+
+    def _remove(self, slot):
+        self._bytes -= self._slots[slot]["size"]
+        self._slots[slot] = None
+        self._active[slot] = False
+
+    def clear(self):
+        with self._lock:
+            self._active[:] = False
+            self._slots = [None] * self.max_entries
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": int(self._active.sum()),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+semantic_cache = SemanticAnswerCache()
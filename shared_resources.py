@@ -0,0 +1,144 @@
+import os
+import asyncio
+import concurrent.futures
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Initialize the Sentence Transformer model
+MODEL_NAME = 'sentence-transformers/multi-qa-MiniLM-L6-cos-v1'
+
+# "torch" runs the model with sentence-transformers; "onnx" / "onnx-int8" run an
+# exported copy with ONNX Runtime on the CPU (see onnx_embedding.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# Identifies the vectors a backend produces, for anything that stores embeddings
+EMBEDDING_MODEL_ID = MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{MODEL_NAME}@{EMBEDDING_BACKEND}"
+
+# Upper bound on worker threads shared by every request in this process
+MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "8"))
+
+# openai, pymilvus and sentence_transformers (torch) are imported on first use, so
+# importing the pipeline modules stays cheap and the server can answer health
+# checks while the model loads. Each resource has its own lock so that a slow
+# model load does not hold up requests that only need the executor.
+_executor_lock = threading.Lock()
+_sentence_model_lock = threading.Lock()
+_milvus_lock = threading.Lock()
+_openai_lock = threading.Lock()
+
+# Default HTTP timeout (seconds) for OpenAI calls; each call also has its own deadline
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+_executor = None
+_sentence_model = None
+_milvus_client = None
+_async_openai_client = None
+_async_openai_loop = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS, thread_name_prefix="pipeline"
+                )
+    return _executor
+
+
+def get_sentence_model():
+    global _sentence_model
+    if _sentence_model is None:
+        with _sentence_model_lock:
+            if _sentence_model is None:
+                if EMBEDDING_BACKEND in ("onnx", "onnx-int8"):
+                    from onnx_embedding import OnnxSentenceEncoder
+                    _sentence_model = OnnxSentenceEncoder(variant="int8" if EMBEDDING_BACKEND == "onnx-int8" else "fp32")
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    _sentence_model = SentenceTransformer(MODEL_NAME)
+    return _sentence_model
+
+
+def get_milvus_client():
+    global _milvus_client
+    if _milvus_client is None:
+        with _milvus_lock:
+            if _milvus_client is None:
+                from pymilvus import MilvusClient
+                # Milvus Client Initialization
+                _milvus_client = MilvusClient(
+                    uri=os.getenv("MILVUS_URI_MAINNET"),
+                    token=os.getenv("MILVUS_TOKEN_MAINNET"),
+                )
+    return _milvus_client
+
+
+def get_async_openai_client():
+    """
+    The AsyncOpenAI client for the running event loop (its connection pool belongs
+    to the loop that created it). A client stored with no loop is used on any loop.
+    """
+    global _async_openai_client, _async_openai_loop
+    loop = asyncio.get_running_loop()
+    if _async_openai_client is None or _async_openai_loop not in (None, loop):
+        with _openai_lock:
+            if _async_openai_client is None or _async_openai_loop not in (None, loop):
+                from openai import AsyncOpenAI
+                # Retries are done by concurrency.retry_async, with jitter and the shared quota
+                _async_openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"), max_retries=0, timeout=OPENAI_TIMEOUT)
+                _async_openai_loop = loop
+    return _async_openai_client
+
+
+async def close_async_openai_client():
+    global _async_openai_client, _async_openai_loop
+    client = _async_openai_client
+    _async_openai_client = None
+    _async_openai_loop = None
+    if client is not None:
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"Error closing OpenAI client: {e}")
+
+
+def init_resources():
+    """Create the process-wide executor, model and clients. Safe to call more than once."""
+    get_executor()
+    # The async OpenAI client is created on the event loop; importing the SDK is the slow part
+    import openai  # noqa: F401
+    if os.getenv("VECTOR_BACKEND", "milvus").lower() != "local":
+        get_milvus_client()
+    get_sentence_model()
+
+
+def warm_up():
+    """
+    init_resources plus one throwaway encode, so the first real question does not
+    pay for torch's lazy initialization.
+    """
+    init_resources()
+    get_sentence_model().encode(["warm up"], convert_to_numpy=True)
+
+
+def shutdown_resources():
+    """Release the shared executor and clients, e.g. from the FastAPI lifespan hook."""
+    global _executor, _sentence_model, _milvus_client, _async_openai_client, _async_openai_loop
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    with _milvus_lock:
+        if _milvus_client is not None:
+            try:
+                _milvus_client.close()
+            except Exception as e:
+                print(f"Error closing Milvus client: {e}")
+            _milvus_client = None
+    with _openai_lock:
+        _async_openai_client = None
+        _async_openai_loop = None
+    with _sentence_model_lock:
+        _sentence_model = None
@@ -0,0 +1,60 @@
+import os
+import json
+import asyncio
+import hashlib
+from embedding_cache import normalize_text
+
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+
+def request_key(kind, question, history):
+    """Identifies requests that get the same answer: same endpoint, question (up to case and spacing) and history."""
+    payload = json.dumps([kind, normalize_text(question), history], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs at most one coroutine per key at a time. Callers that arrive while a key
+    is in flight await the same task and get the same result (or exception)
+    instead of starting their own. The shared task is only cancelled once every
+    caller waiting on it has gone away.
+    """
+
+    def __init__(self, enabled=COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._flights = {}  # key -> [task, number of callers waiting]
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda _, key=key, flight=flight: self._finished(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            if flight[1] == 1 and not flight[0].done():
+                flight[0].cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _finished(self, key, flight):
+        # Later requests start a fresh run; only drop the entry if it is still this flight
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}
+
+
+pipeline_flights = SingleFlight()
@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Cached SPARQL results expire after this many seconds
+SPARQL_CACHE_TTL = float(os.getenv("SPARQL_CACHE_TTL", "600"))
+# Empty results expire sooner, so a query run before new Knowledge Assets reached the
+# node does not keep answering "no results" for the full TTL; 0 stops caching them
+SPARQL_CACHE_EMPTY_TTL = float(os.getenv("SPARQL_CACHE_EMPTY_TTL", "30"))
+# Upper bound on the (approximate, JSON-encoded) size of all cached results
+SPARQL_CACHE_MAX_BYTES = int(os.getenv("SPARQL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+_PREFIX_RE = re.compile(r"^\s*PREFIX\s+(\S*:)\s*(<[^>]*>)\s*$", re.IGNORECASE | re.MULTILINE)
+_LITERAL_RE = re.compile(r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*'|<[^>\s]*>)")
+
+
+def normalize_query(query):
+    """
+    Canonical form of a SPARQL query used as the cache key: PREFIX declarations are
+    de-duplicated and sorted, and whitespace outside literals and IRIs is collapsed.
+    """
+    prefixes = sorted({f"PREFIX {prefix} {uri}" for prefix, uri in _PREFIX_RE.findall(query)})
+    body = _PREFIX_RE.sub("", query)
+    parts = _LITERAL_RE.split(body)
+    for i in range(0, len(parts), 2):
+        # Even indexes are outside literals/IRIs
+        part = re.sub(r"\s+", " ", parts[i])
+        parts[i] = re.sub(r"\s*([{}().;,])\s*", r"\1", part)
+    return "\n".join(prefixes + ["".join(parts).strip()])
+
+
+class SPARQLResultCache:
+    """Thread-safe TTL + LRU cache of SPARQL results bounded by total size in bytes."""
+
+    def __init__(self, ttl=SPARQL_CACHE_TTL, max_bytes=SPARQL_CACHE_MAX_BYTES, empty_ttl=SPARQL_CACHE_EMPTY_TTL):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(query):
+        return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+    def get(self, query):
+        """Returns the cached result for the query, or None on a miss."""
+        key = self.key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query, result):
+        ttl = self.ttl if result else min(self.ttl, self.empty_ttl)
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes or ttl <= 0:
+            return
+        key = self.key(query)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.monotonic() + ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self):
+        """Drop every cached result, e.g. after new Knowledge Assets are published."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+sparql_cache = SPARQLResultCache()
+
+
+def invalidate_sparql_cache():
+    sparql_cache.invalidate()
@@ -0,0 +1,69 @@
+import re
+import json
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+
+class JSONStringFieldStreamer:
+    """
+    Pulls the value of one top-level string field out of a JSON document while it
+    is still being generated. feed() takes the next raw chunk of the document and
+    returns whatever new, unescaped characters of the field value it completed.
+    """
+
+    def __init__(self, field):
+        self._key_re = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._key_re.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        buffer, i, out = self._buffer, self._pos, []
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char == '\\':
+                # Wait for the rest of an escape sequence split across chunks
+                if i + 1 >= len(buffer):
+                    break
+                escape = buffer[i + 1]
+                if escape == 'u':
+                    if i + 6 > len(buffer):
+                        break
+                    code = int(buffer[i + 2:i + 6], 16)
+                    if 0xD800 <= code <= 0xDBFF:
+                        # High surrogate; combine with the \uXXXX low surrogate that follows
+                        if i + 12 > len(buffer):
+                            break
+                        if buffer[i + 6:i + 8] == '\\u':
+                            low = int(buffer[i + 8:i + 12], 16)
+                            out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                            i += 12
+                            continue
+                    out.append(chr(code))
+                    i += 6
+                    continue
+                out.append(_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            out.append(char)
+            i += 1
+        self._pos = i
+        return "".join(out)
+
+
+def format_sse(event, data):
+    """Encodes one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
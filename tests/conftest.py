@@ -0,0 +1,21 @@
+import os
+import sys
+import importlib
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules are flat files in the repository root and in Embeddings/
+for path in (ROOT, os.path.join(ROOT, "Embeddings")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import fake_milvus
+
+
+@pytest.fixture
+def milvus(monkeypatch):
+    """Imports ingestion against an in-memory pymilvus; returns (ingestion, utility)."""
+    module = fake_milvus.module()
+    monkeypatch.setitem(sys.modules, "pymilvus", module)
+    monkeypatch.delitem(sys.modules, "ingestion", raising=False)
+    return importlib.import_module("ingestion"), module.utility
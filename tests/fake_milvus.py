@@ -0,0 +1,94 @@
+"""
+In-memory stand-in for the parts of pymilvus that Embeddings/ingestion.py uses:
+Collection (insert, query, query_iterator, delete) and utility (collections and
+aliases). Installed as the pymilvus module by the milvus fixture in conftest.py.
+"""
+import ast
+import types
+
+
+class FakeUtility:
+    def __init__(self):
+        self.collections = {}  # name -> FakeCollection
+        self.aliases = {}  # alias -> collection name
+        self.dropped = []
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def list_aliases(self, name):
+        return [alias for alias, target in self.aliases.items() if target == name]
+
+    def has_collection(self, name):
+        return name in self.collections
+
+    def create_alias(self, collection_name, alias):
+        assert alias not in self.aliases and alias not in self.collections
+        self.aliases[alias] = collection_name
+
+    def alter_alias(self, collection_name, alias):
+        assert alias in self.aliases
+        self.aliases[alias] = collection_name
+
+    def drop_alias(self, alias):
+        del self.aliases[alias]
+
+    def drop_collection(self, name):
+        assert name not in self.aliases.values(), "Milvus refuses to drop a collection that has an alias"
+        del self.collections[name]
+        self.dropped.append(name)
+
+
+def _ids(expr):
+    # ingestion only filters with "id in [...]"
+    return set(ast.literal_eval(expr.split(" in ", 1)[1]))
+
+
+class _Iterator:
+    def __init__(self, rows, batch_size):
+        self.batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    def next(self):
+        return self.batches.pop(0) if self.batches else []
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+    """Rows are dicts with an auto id; insert takes column lists in the order of fields."""
+
+    def __init__(self, utility, name, fields):
+        self.name = name
+        self.fields = fields
+        self.rows = []
+        self.next_id = 1
+        utility.collections[name] = self
+
+    def insert(self, columns):
+        assert len(columns) == len(self.fields)
+        for values in zip(*columns):
+            self.rows.append(dict(zip(self.fields, values), id=self.next_id))
+            self.next_id += 1
+
+    def _select(self, row, output_fields):
+        return {name: row[name] for name in ["id"] + list(output_fields)}
+
+    def query(self, expr, output_fields):
+        ids = _ids(expr)
+        return [self._select(row, output_fields) for row in self.rows if row["id"] in ids]
+
+    def query_iterator(self, batch_size, output_fields):
+        return _Iterator([self._select(row, output_fields) for row in self.rows], batch_size)
+
+    def delete(self, expr):
+        ids = _ids(expr)
+        self.rows = [row for row in self.rows if row["id"] not in ids]
+
+
+def module():
+    """A fresh pymilvus module with its own utility state."""
+    pymilvus = types.ModuleType("pymilvus")
+    pymilvus.utility = FakeUtility()
+    pymilvus.Collection = lambda name, **kwargs: pymilvus.utility.collections[name]
+    return pymilvus
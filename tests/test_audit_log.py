@@ -0,0 +1,56 @@
+import json
+from audit_log import AuditLogWriter, pipeline_audit_fields
+
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_records_are_written_as_json_lines_by_stop(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    writer = AuditLogWriter(str(path))
+    assert writer.write("query", user="jane", question="Who?")
+    writer.write("feedback", user="jane", rating=1)
+    writer.stop()
+    records = read_records(path)
+    assert [record["event"] for record in records] == ["query", "feedback"]
+    assert records[0]["user"] == "jane" and "ts" in records[0]
+
+
+def test_full_queue_drops_records_instead_of_blocking(tmp_path):
+    writer = AuditLogWriter(str(tmp_path / "audit.jsonl"), queue_size=1)
+    # Looks started to write(), but no thread drains the queue
+    writer._thread = object()
+    assert writer.write("a")
+    assert not writer.write("b")
+    assert writer.dropped == 1
+
+
+def test_file_is_rotated_at_max_bytes(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    writer = AuditLogWriter(str(path), max_bytes=200, backup_count=2)
+    for i in range(10):
+        writer.write("query", question="x" * 50, n=i)
+    writer.stop()
+    assert (tmp_path / "audit.jsonl.1").exists()
+    assert read_records(path)[-1]["n"] == 9
+
+
+def test_pipeline_fields_summarise_the_context():
+    context = {
+        "response_data": {"Classification": "SPARQL"},
+        "timings": {"llm": 1.23456},
+        "llm_usage": {"cost": 0.02, "prompt_tokens": 900, "completion_tokens": 80},
+        "semantic_cache_hit": False,
+        "sparql_cache_hit": True,
+        "speculative_sparql": "hit",
+    }
+    assert pipeline_audit_fields(context) == {
+        "classification": "SPARQL",
+        "latency": {"llm": 1.2346},
+        "cost": 0.02,
+        "tokens": {"prompt": 900, "completion": 80},
+        "cache_hits": {"semantic": False, "sparql": True},
+        "speculative_sparql": "hit",
+    }
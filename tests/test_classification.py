@@ -0,0 +1,46 @@
+from RAG_SPARQL_MAINNET import load_json_object, validate_classification
+
+
+def test_load_json_object_plain():
+    assert load_json_object('{"Classification": "RAG"}') == {"Classification": "RAG"}
+
+
+def test_load_json_object_in_code_fence_with_surrounding_text():
+    text = 'Here you go:\n```json\n{"Classification": "SPARQL", "SPARQL": "SELECT ?s WHERE {?s ?p ?o}"}\n```'
+    assert load_json_object(text) == {"Classification": "SPARQL", "SPARQL": "SELECT ?s WHERE {?s ?p ?o}"}
+
+
+def test_load_json_object_single_quoted_dict():
+    assert load_json_object("{'Classification': 'RAG', 'Response': 'hi'}") == {"Classification": "RAG", "Response": "hi"}
+
+
+def test_load_json_object_rejects_non_objects():
+    assert load_json_object("") is None
+    assert load_json_object(None) is None
+    assert load_json_object("no json here") is None
+    assert load_json_object("{not valid") is None
+    assert load_json_object("[1, 2]") is None
+
+
+def test_validate_classification_normalizes_keys_and_response_shape():
+    result = validate_classification({
+        "classification": "rag",
+        "response": {"text": "Answer", "UALs": ["did:1", "did:2", "did:1", ""]},
+    })
+    assert result == {"Classification": "RAG", "SPARQL": "", "Response": {"Text": "Answer", "UALs": ["did:1", "did:2"]}}
+
+
+def test_validate_classification_infers_missing_label():
+    assert validate_classification({"SPARQL": "SELECT ?s WHERE {?s ?p ?o}"})["Classification"] == "SPARQL"
+    assert validate_classification({"Response": "Answer", "UALs": "did:1"})["Response"] == {"Text": "Answer", "UALs": ["did:1"]}
+
+
+def test_validate_classification_drops_query_for_rag_and_bad_types():
+    result = validate_classification({"Classification": "RAG", "Response": 42, "SPARQL": "SELECT 1", "UALs": 7})
+    assert result == {"Classification": "RAG", "SPARQL": "", "Response": {"Text": "42", "UALs": []}}
+    assert validate_classification({"Classification": "SPARQL", "SPARQL": ["not", "a", "string"], "Response": "x"})["SPARQL"] == ""
+
+
+def test_validate_classification_without_answer_or_query():
+    assert validate_classification({}) is None
+    assert validate_classification({"Classification": "unknown", "Response": "  "}) is None
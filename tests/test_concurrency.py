@@ -0,0 +1,120 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+import pytest
+import concurrency
+from concurrency import TokenBucket, retry_async, run_in_upstream_slot, upstream_slot
+
+
+def elapsed(coroutine_fn):
+    async def main():
+        started = time.monotonic()
+        await coroutine_fn()
+        return time.monotonic() - started
+    return asyncio.run(main())
+
+
+def test_zero_rate_is_unlimited():
+    bucket = TokenBucket(0)
+
+    async def take():
+        for _ in range(1000):
+            await bucket.acquire(1000)
+
+    assert elapsed(take) < 0.1
+
+
+def test_burst_up_to_capacity_then_waits_for_refill():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def burst():
+        await bucket.acquire()
+        await bucket.acquire()
+
+    assert elapsed(burst) < 0.03
+    # Empty now: one more token takes 1/20 s to refill
+    assert elapsed(bucket.acquire) >= 0.04
+
+
+def test_request_larger_than_capacity_is_capped():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def take():
+        await bucket.acquire(1)
+        await bucket.acquire(100)
+
+    # Waits for one full bucket, not for 100 tokens
+    assert elapsed(take) < 0.5
+
+
+def test_tokens_are_charged():
+    bucket = TokenBucket(rate=1, capacity=10)
+    asyncio.run(bucket.acquire(4))
+    assert 5.9 <= bucket.tokens <= 6.1
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setitem(concurrency._upstream_semaphores, "test", concurrency._LoopLocal(lambda: asyncio.Semaphore(1)))
+    monkeypatch.setattr(concurrency, "backoff_delay", lambda attempt, exc=None: 0.05)
+    return "test"
+
+
+class Unavailable(Exception):
+    status_code = 503
+
+
+def test_retry_async_gives_the_slot_back_while_backing_off(one_slot):
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise Unavailable()
+        return "ok"
+
+    async def other():
+        await asyncio.sleep(0.01)
+        async with upstream_slot(one_slot):
+            return time.monotonic()
+
+    async def main():
+        return await asyncio.gather(retry_async("test", flaky, slot=one_slot), other())
+
+    result, other_got_slot = asyncio.run(main())
+    assert result == "ok"
+    # The other call ran during the backoff, before the second attempt
+    assert attempts[0] < other_got_slot < attempts[1]
+
+
+def test_retry_async_raises_other_errors_at_once(one_slot):
+    attempts = []
+
+    async def bad():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_async("test", bad, slot=one_slot))
+    assert attempts == [1]
+
+
+def test_executor_call_keeps_its_slot_after_the_caller_is_cancelled(one_slot):
+    executor = concurrent.futures.ThreadPoolExecutor(2)
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.1)
+        finished.set()
+
+    async def main():
+        caller = asyncio.ensure_future(run_in_upstream_slot(one_slot, executor, slow))
+        await asyncio.sleep(0.02)
+        caller.cancel()
+        # The thread is still running, so the next call waits for it
+        await run_in_upstream_slot(one_slot, executor, lambda: None)
+        return finished.is_set()
+
+    assert asyncio.run(main())
+    executor.shutdown()
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import pytest
+import concurrency
+import dkg_client
+from dkg_client import DKGClientPool
+from sparql_cache import SPARQLResultCache
+
+
+class NodeRequestError(Exception):
+    """Like dkg's: raised while handling the underlying requests error."""
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"{status_code} error")
+        self.response = type("Response", (), {"status_code": status_code, "headers": {}})()
+
+
+def node_error(status_code):
+    try:
+        try:
+            raise HTTPError(status_code)
+        except HTTPError:
+            raise NodeRequestError(f"Request failed: {status_code}")
+    except NodeRequestError as e:
+        return e
+
+
+class FakeClient:
+    """DKG client whose graph.query returns or raises what the test queued."""
+
+    def __init__(self, outcomes):
+        self.graph = self
+        self.node = self
+        self.outcomes = outcomes
+        self.queries = 0
+        self.healthy = True
+
+    @property
+    def info(self):
+        if not self.healthy:
+            raise ConnectionError("node went away")
+        return {"version": "test"}
+
+    def query(self, query, repository=None):
+        self.queries += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else [{"query": query}]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome() if callable(outcome) else outcome
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A one-client pool installed as dkg_client.dkg_pool, with an empty SPARQL cache and no backoff."""
+    outcomes, clients = [], []
+
+    def factory():
+        clients.append(FakeClient(outcomes))
+        return clients[-1]
+
+    pool = DKGClientPool(size=1, factory=factory)
+    monkeypatch.setattr(dkg_client, "dkg_pool", pool)
+    monkeypatch.setattr(dkg_client, "sparql_cache", SPARQLResultCache())
+    monkeypatch.setattr(concurrency, "backoff_delay", lambda attempt, exc=None: 0)
+    pool.outcomes, pool.clients = outcomes, clients
+    return pool
+
+
+def test_clients_are_reused(pool):
+    pool.query("q1")
+    pool.query("q2")
+    assert len(pool.clients) == 1
+    assert pool.clients[0].queries == 2
+
+
+def test_idle_client_is_replaced_when_it_fails_the_health_check(pool):
+    pool.health_check_interval = 0
+    pool.query("q1")
+    pool.clients[0].healthy = False
+    pool.query("q2")
+    assert len(pool.clients) == 2
+    assert pool.clients[1].queries == 1
+
+
+def test_rejected_query_keeps_the_client(pool):
+    pool.outcomes.append(node_error(400))
+    with pytest.raises(NodeRequestError):
+        pool.query("bad")
+    pool.query("good")
+    assert len(pool.clients) == 1
+
+
+def test_transport_error_replaces_the_client(pool):
+    pool.outcomes.append(node_error(502))
+    with pytest.raises(NodeRequestError):
+        pool.query("q")
+    pool.query("q")
+    assert len(pool.clients) == 2
+
+
+def test_lease_times_out_when_every_client_is_taken(pool):
+    with pool.lease():
+        with pytest.raises(TimeoutError):
+            with pool.lease(timeout=0.01):
+                pass
+
+
+def test_async_query_retries_transport_errors_only(pool):
+    pool.outcomes.extend([node_error(503), [{"s": "1"}]])
+    assert asyncio.run(dkg_client.execute_sparql_query_async("q")) == [{"s": "1"}]
+    assert len(pool.clients) == 2
+
+    pool.outcomes.append(node_error(400))
+    assert asyncio.run(dkg_client.execute_sparql_query_async("bad")) == []
+    assert sum(client.queries for client in pool.clients) == 3
+
+
+def test_async_query_is_served_from_the_cache(pool):
+    status = {}
+    asyncio.run(dkg_client.execute_sparql_query_async("SELECT ?s WHERE { ?s ?p ?o }", status))
+    assert status == {"cache_hit": False}
+    asyncio.run(dkg_client.execute_sparql_query_async("SELECT ?s WHERE {?s ?p ?o}", status))
+    assert status == {"cache_hit": True}
+    assert pool.clients[0].queries == 1
+
+
+def test_cancelled_query_keeps_its_slot_until_the_node_answers(pool, monkeypatch):
+    monkeypatch.setitem(concurrency._upstream_semaphores, "dkg", concurrency._LoopLocal(lambda: asyncio.Semaphore(1)))
+    pool.outcomes.append(lambda: time.sleep(0.2) or [{"s": "slow"}])
+    free_clients = []
+    lease = pool.lease
+
+    def recording_lease(*args, **kwargs):
+        free_clients.append(pool._slots._value)
+        return lease(*args, **kwargs)
+
+    monkeypatch.setattr(pool, "lease", recording_lease)
+
+    async def main():
+        speculative = asyncio.ensure_future(dkg_client.execute_sparql_query_async("slow"))
+        await asyncio.sleep(0.05)
+        speculative.cancel()
+        started = time.monotonic()
+        result = await dkg_client.execute_sparql_query_async("next")
+        return result, time.monotonic() - started
+
+    result, waited = asyncio.run(main())
+    assert result == [{"query": "next"}]
+    assert waited >= 0.1
+    # The second query waited for a slot on the event loop, not in a thread blocked on the pool
+    assert free_clients == [1, 1]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from embedding_cache import EmbeddingCache, normalize_text
+
+
+def vector(value, dimension=4):
+    return np.full(dimension, value, dtype=np.float32)
+
+
+def test_lookup_ignores_case_and_spacing():
+    cache = EmbeddingCache(capacity=2, dimension=4)
+    cache.put("Who is  Jane?", vector(1))
+    np.testing.assert_array_equal(cache.get(" who is jane? "), vector(1))
+    assert normalize_text("  Who\tis Jane? ") == "who is jane?"
+
+
+def test_returned_rows_are_read_only_views():
+    cache = EmbeddingCache(capacity=2, dimension=4)
+    cache.put("a", vector(1))
+    row = cache.get("a")
+    with pytest.raises(ValueError):
+        row[0] = 5
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = EmbeddingCache(capacity=2, dimension=4)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    cache.get("a")
+    cache.put("c", vector(3))
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), vector(1))
+    np.testing.assert_array_equal(cache.get("c"), vector(3))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_put_of_a_cached_text_overwrites_its_row():
+    cache = EmbeddingCache(capacity=2, dimension=4)
+    cache.put("a", vector(1))
+    cache.put("a", vector(7))
+    assert cache.stats()["entries"] == 1
+    np.testing.assert_array_equal(cache.get("a"), vector(7))
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = EmbeddingCache(capacity=0, dimension=4)
+    cache.put("a", vector(1))
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,78 @@
+import asyncio
+import numpy as np
+import pytest
+import embedding_service
+from embedding_cache import EmbeddingCache
+from embedding_service import MicroBatchEncoder
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(embedding_service, "embedding_cache", EmbeddingCache(capacity=8, dimension=2))
+
+
+class RecordingEncoder:
+    """Encodes each text as [len(text), 1], recording the batches it was given."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1] for text in texts], dtype=np.float32)
+
+
+def run(encoder, coroutine_fn):
+    async def main():
+        try:
+            return await coroutine_fn()
+        finally:
+            await encoder.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_questions_are_encoded_in_one_batch():
+    encode = RecordingEncoder()
+    encoder = MicroBatchEncoder(encode, window_ms=20)
+    vectors = run(encoder, lambda: asyncio.gather(*(encoder.encode(text) for text in ("a", "bb", "ccc"))))
+    assert encode.batches == [["a", "bb", "ccc"]]
+    assert [vector[0] for vector in vectors] == [1, 2, 3]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    encode = RecordingEncoder()
+    encoder = MicroBatchEncoder(encode, window_ms=20, max_batch_size=2)
+    run(encoder, lambda: asyncio.gather(*(encoder.encode(text) for text in ("a", "b", "c"))))
+    assert encode.batches == [["a", "b"], ["c"]]
+
+
+def test_repeated_question_is_served_from_the_cache():
+    encode = RecordingEncoder()
+    encoder = MicroBatchEncoder(encode, window_ms=0)
+
+    async def twice():
+        await encoder.encode("Who is Jane?")
+        return await encoder.encode("who is  jane?")
+
+    assert run(encoder, twice)[0] == 12
+    assert encode.batches == [["Who is Jane?"]]
+
+
+def test_encoding_error_reaches_every_caller_and_the_batcher_keeps_going():
+    encode = RecordingEncoder()
+
+    def failing_once(texts):
+        if not encode.batches:
+            encode.batches.append(None)
+            raise RuntimeError("model failed")
+        return encode(texts)
+
+    encoder = MicroBatchEncoder(failing_once, window_ms=20)
+
+    async def main():
+        results = await asyncio.gather(encoder.encode("a"), encoder.encode("b"), return_exceptions=True)
+        return results, await encoder.encode("c")
+
+    results, vector = run(encoder, main)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert vector[0] == 1
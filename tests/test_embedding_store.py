@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from embedding_store import EmbeddingStore
+
+DIMENSION = 4
+
+
+def store_in(path, model_id="test-model", dimension=DIMENSION):
+    return EmbeddingStore(model_id=model_id, store_dir=str(path), dimension=dimension)
+
+
+def vectors(*values):
+    return np.array([[value] * DIMENSION for value in values], dtype=np.float32)
+
+
+def test_add_and_lookup(tmp_path):
+    store = store_in(tmp_path)
+    store.add(["a", "b"], vectors(1, 2))
+    assert len(store) == 2
+    assert store.lookup(["b", "missing", "a"]).tolist() == [1, -1, 0]
+    np.testing.assert_array_equal(store.matrix(store.lookup(["b", "a"])), vectors(2, 1))
+
+
+def test_add_skips_stored_and_repeated_texts(tmp_path):
+    store = store_in(tmp_path)
+    store.add(["a"], vectors(1))
+    store.add(["a", "b", "b", "c"], vectors(9, 2, 8, 3))
+    assert len(store) == 3
+    np.testing.assert_array_equal(store.matrix(store.lookup(["a", "b", "c"])), vectors(1, 2, 3))
+
+
+def test_other_instances_see_appended_rows(tmp_path):
+    writer = store_in(tmp_path)
+    reader = store_in(tmp_path)
+    writer.add(["a"], vectors(1))
+    assert reader.lookup(["a"]).tolist() == [-1]
+    reader.refresh()
+    assert reader.lookup(["a"]).tolist() == [0]
+    # Both append without overwriting each other's rows
+    reader.add(["b"], vectors(2))
+    writer.refresh()
+    np.testing.assert_array_equal(writer.matrix(writer.lookup(["a", "b"])), vectors(1, 2))
+
+
+def test_encode_only_embeds_missing_texts(tmp_path):
+    store = store_in(tmp_path)
+    store.add(["a"], vectors(1))
+    encoded = []
+
+    def encode(texts):
+        encoded.append(list(texts))
+        return vectors(*[len(text) for text in texts])
+
+    result = store.encode(["a", "bb", "bb", "ccc"], encode)
+    assert encoded == [["bb", "ccc"]]
+    np.testing.assert_array_equal(result, vectors(1, 2, 2, 3))
+    assert store.stats() == {"rows": 3, "hits": 1, "misses": 2}
+
+
+def test_matrix_of_unknown_row_raises(tmp_path):
+    store = store_in(tmp_path)
+    with pytest.raises(KeyError):
+        store.matrix([-1])
+
+
+def test_models_are_kept_apart(tmp_path):
+    store_in(tmp_path, model_id="model-a").add(["a"], vectors(1))
+    assert len(store_in(tmp_path, model_id="model-b")) == 0
+
+
+def test_dimension_mismatch_is_refused(tmp_path):
+    store_in(tmp_path)
+    with pytest.raises(RuntimeError):
+        store_in(tmp_path, dimension=DIMENSION + 1)
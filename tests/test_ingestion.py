@@ -0,0 +1,142 @@
+import threading
+import numpy as np
+import pandas as pd
+from fake_milvus import FakeCollection
+
+FIELDS = ["EntityID", "RAG", "UAL", "text_hash", "row_hash", "vector"]
+
+
+def entity_fields(chunk):
+    return {name: chunk[name].tolist() for name in ("EntityID", "RAG", "UAL")}
+
+
+class CountingEmbedder:
+    """Vectors derived from the text length, recording every text it encodes."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def write_tsv(path, rows):
+    pd.DataFrame(rows, columns=["EntityID", "RAG", "UAL"]).to_csv(path, sep="\t", index=False)
+
+
+def sync(ingestion, path, collection, embedder):
+    return ingestion.sync_upload(str(path), collection, "EntityID", "RAG", entity_fields, embedder)
+
+
+def by_key(collection):
+    return {row["EntityID"]: row for row in collection.rows}
+
+
+def test_swap_alias_repoints_alias_and_drops_old_collection(milvus):
+    ingestion, utility = milvus
+    FakeCollection(utility, "Entities_v1", FIELDS)
+    FakeCollection(utility, "Entities_v2", FIELDS)
+    utility.create_alias("Entities_v1", "Entities")
+
+    ingestion.swap_alias("Entities", "Entities_v2")
+
+    assert utility.aliases == {"Entities": "Entities_v2"}
+    assert utility.dropped == ["Entities_v1"]
+
+
+def test_swap_alias_to_the_live_collection_drops_nothing(milvus):
+    ingestion, utility = milvus
+    FakeCollection(utility, "Entities_v1", FIELDS)
+    utility.create_alias("Entities_v1", "Entities")
+
+    ingestion.swap_alias("Entities", "Entities_v1")
+
+    assert utility.aliases == {"Entities": "Entities_v1"}
+    assert utility.dropped == []
+
+
+def test_swap_alias_replaces_plain_collection_with_alias(milvus):
+    ingestion, utility = milvus
+    FakeCollection(utility, "Entities", FIELDS)
+    FakeCollection(utility, "Entities_v2", FIELDS)
+
+    ingestion.swap_alias("Entities", "Entities_v2")
+
+    assert utility.aliases == {"Entities": "Entities_v2"}
+    assert utility.dropped == ["Entities"]
+    assert ingestion.resolve_collection("Entities") == "Entities_v2"
+
+
+def test_sync_upload_into_empty_collection_adds_every_row(milvus, tmp_path):
+    ingestion, utility = milvus
+    collection = FakeCollection(utility, "Entities", FIELDS)
+    path = tmp_path / "entities.tsv"
+    write_tsv(path, [["a", "alpha", "did:1"], ["b", "beta", "did:2"]])
+    embedder = CountingEmbedder()
+
+    counts = sync(ingestion, path, collection, embedder)
+
+    assert counts == {"added": 2, "reembedded": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    assert embedder.encoded == ["alpha", "beta"]
+    assert set(by_key(collection)) == {"a", "b"}
+
+
+def test_sync_upload_only_embeds_changed_text(milvus, tmp_path):
+    ingestion, utility = milvus
+    collection = FakeCollection(utility, "Entities", FIELDS)
+    path = tmp_path / "entities.tsv"
+    write_tsv(path, [["a", "alpha", "did:1"], ["b", "beta", "did:2"], ["c", "gamma", "did:3"], ["d", "delta", "did:4"]])
+    sync(ingestion, path, collection, CountingEmbedder())
+    old = by_key(collection)
+
+    # a: text changed, b: only the UAL changed, c: unchanged, d: removed, e: new
+    write_tsv(path, [["a", "alpha two", "did:1"], ["b", "beta", "did:22"], ["c", "gamma", "did:3"], ["e", "epsilon", "did:5"]])
+    embedder = CountingEmbedder()
+    counts = sync(ingestion, path, collection, embedder)
+
+    assert counts == {"added": 1, "reembedded": 1, "updated": 1, "unchanged": 1, "deleted": 1}
+    assert sorted(embedder.encoded) == ["alpha two", "epsilon"]
+    rows = by_key(collection)
+    assert set(rows) == {"a", "b", "c", "e"}
+    assert len(collection.rows) == 4
+    assert rows["b"]["UAL"] == "did:22"
+    assert rows["b"]["vector"] == old["b"]["vector"]
+    assert rows["c"]["id"] == old["c"]["id"]
+    assert rows["a"]["vector"] == [float(len("alpha two")), 1.0]
+
+
+def test_sync_upload_is_idempotent_and_removes_duplicate_keys(milvus, tmp_path):
+    ingestion, utility = milvus
+    collection = FakeCollection(utility, "Entities", FIELDS)
+    path = tmp_path / "entities.tsv"
+    write_tsv(path, [["a", "alpha", "did:1"]])
+    sync(ingestion, path, collection, CountingEmbedder())
+    # A second copy of "a", as left by an interrupted plain upload
+    collection.insert([[collection.rows[0][name]] for name in FIELDS])
+
+    embedder = CountingEmbedder()
+    counts = sync(ingestion, path, collection, embedder)
+
+    assert counts == {"added": 0, "reembedded": 0, "updated": 0, "unchanged": 1, "deleted": 1}
+    assert embedder.encoded == []
+    assert len(collection.rows) == 1
+
+
+class RecordingModel:
+    def __init__(self):
+        self.encoded = threading.Event()
+
+    def encode(self, texts, batch_size, convert_to_numpy):
+        self.encoded.set()
+        return np.ones((len(texts), 2))
+
+
+def test_in_process_embedder_encodes_in_the_background(milvus):
+    ingestion, _ = milvus
+    with ingestion.Embedder(workers=0, batch_size=2, use_store=False) as embedder:
+        embedder.model = RecordingModel()
+        pending = embedder.submit(["a", "b", "c"])
+        # Encoding starts without waiting for the result to be asked for
+        assert embedder.model.encoded.wait(1)
+        assert pending().shape == (3, 2)
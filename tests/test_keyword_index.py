@@ -0,0 +1,58 @@
+from keyword_index import KeywordIndex, reciprocal_rank_fusion
+from retrieval import SearchHit, ENTITY_COLLECTION
+
+ROWS = [
+    {"EntityID": "https://example.com/urn:profile:0xLuo", "NER": "0xLuo;Luo", "RAG": "Builder working on regenerative finance", "UAL": "did:dkg:base:8453/0xabc/1"},
+    {"EntityID": "https://example.com/urn:profile:JaneDoe", "NER": "Jane Doe;Jane", "RAG": "Researcher on soil carbon and forests", "UAL": "did:dkg:base:8453/0xabc/2"},
+    {"EntityID": "https://example.com/urn:org:Arweave", "NER": "Arweave", "RAG": "Permanent storage network, used by Jane Doe", "UAL": "did:dkg:base:8453/0xabc/3"},
+]
+
+
+def ids(hits):
+    return [hit.get("EntityID").split(":")[-1] for hit in hits]
+
+
+def vector_hit(row, distance):
+    return SearchHit(ENTITY_COLLECTION, row["UAL"], distance, dict(row))
+
+
+def test_exact_handle_match_ranks_first():
+    index = KeywordIndex(ROWS)
+    hits = index.search("what does 0xluo work on?")
+    assert ids(hits)[0] == "0xLuo"
+    assert hits[0].distance is None
+
+
+def test_multi_word_name_beats_mentions_in_text():
+    index = KeywordIndex(ROWS)
+    assert ids(index.search("Tell me about Jane Doe"))[:2] == ["JaneDoe", "Arweave"]
+
+
+def test_ual_in_question_is_found():
+    index = KeywordIndex(ROWS)
+    assert ids(index.search("What is did:dkg:base:8453/0xabc/3?"))[0] == "Arweave"
+
+
+def test_bm25_matches_terms_in_rag_text():
+    index = KeywordIndex(ROWS)
+    assert ids(index.search("who researches carbon in forests"))[0] == "JaneDoe"
+
+
+def test_stopwords_alone_match_nothing():
+    assert KeywordIndex(ROWS).search("who is the") == []
+
+
+def test_fusion_promotes_hits_found_by_both():
+    vector_hits = [vector_hit(ROWS[0], 0.4), vector_hit(ROWS[1], 0.5)]
+    keyword_hits = KeywordIndex(ROWS).search("Jane Doe")
+    fused = reciprocal_rank_fusion([vector_hits, keyword_hits], limit=3, k=60)
+    assert ids(fused) == ["JaneDoe", "0xLuo", "Arweave"]
+    # Found by both: keeps the vector hit's distance and sums both ranks
+    assert fused[0].distance == 0.5
+    assert abs(fused[0].score - (1 / 62 + 1 / 61)) < 1e-9
+    assert fused[2].distance is None
+
+
+def test_fusion_respects_limit():
+    vector_hits = [vector_hit(row, 0.1 * i) for i, row in enumerate(ROWS)]
+    assert len(reciprocal_rank_fusion([vector_hits, []], limit=2)) == 2
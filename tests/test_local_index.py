@@ -0,0 +1,59 @@
+import functools
+import numpy as np
+import pandas as pd
+import pytest
+import local_index
+from local_index import LocalVectorIndex, load_index
+from embedding_store import EmbeddingStore
+
+
+def test_search_returns_the_nearest_rows_with_squared_l2_distances():
+    vectors = np.array([[0, 0], [1, 0], [3, 4]], dtype=np.float32)
+    index = LocalVectorIndex("EntityCollection", vectors, [{"EntityID": name} for name in "abc"])
+    hits = index.search([1, 1], limit=2)
+    assert [hit.get("EntityID") for hit in hits] == ["b", "a"]
+    assert [hit.distance for hit in hits] == pytest.approx([1.0, 2.0])
+    assert len(index.search([0, 0], limit=10)) == 3
+
+
+@pytest.fixture
+def entities(tmp_path, monkeypatch):
+    """An entities TSV and a store of 2-d vectors, both in tmp_path; returns (tsv path, encoded texts)."""
+    path = tmp_path / "entities.tsv"
+    spec = dict(local_index.LOCAL_COLLECTIONS["EntityCollection"], source=str(path))
+    monkeypatch.setitem(local_index.LOCAL_COLLECTIONS, "EntityCollection", spec)
+    monkeypatch.setattr(local_index, "EmbeddingStore", functools.partial(EmbeddingStore, store_dir=str(tmp_path / "store"), dimension=2))
+    return path, []
+
+
+def write_entities(path, names):
+    rows = [[f"urn:{name}", name, f"about {name}", f"did:{i}"] for i, name in enumerate(names)]
+    pd.DataFrame(rows, columns=["EntityID", "NER", "RAG", "UAL"]).to_csv(path, sep="\t", index=False)
+
+
+def load(tmp_path, encoded):
+    def encode(texts):
+        encoded.extend(texts)
+        return np.array([[len(text), 0] for text in texts], dtype=np.float32)
+    return load_index("EntityCollection", encode, index_dir=str(tmp_path / "index"), model_name="test-model")
+
+
+def test_index_is_built_once_and_reused(tmp_path, entities):
+    path, encoded = entities
+    write_entities(path, ["Jane", "Arweave"])
+    index = load(tmp_path, encoded)
+    assert encoded == ["Jane", "Arweave"]
+    assert index.search([4, 0], limit=1)[0].get("EntityID") == "urn:Jane"
+
+    load(tmp_path, encoded)
+    assert encoded == ["Jane", "Arweave"]
+
+
+def test_changed_tsv_is_reindexed_embedding_only_new_text(tmp_path, entities):
+    path, encoded = entities
+    write_entities(path, ["Jane", "Arweave"])
+    load(tmp_path, encoded)
+    write_entities(path, ["Jane", "Arweave", "Gitcoin"])
+    index = load(tmp_path, encoded)
+    assert encoded == ["Jane", "Arweave", "Gitcoin"]
+    assert len(index.rows) == 3
@@ -0,0 +1,65 @@
+import asyncio
+import metrics
+from metrics import Histogram, render_gauges, span, timed_function
+
+
+def histogram(name="test_seconds", label_names=("stage",)):
+    # Built without registering it, so /metrics output stays unchanged
+    registry = list(metrics._registry)
+    created = Histogram(name, "Test histogram.", label_names, buckets=(0.1, 1.0))
+    metrics._registry[:] = registry
+    return created
+
+
+def test_histogram_renders_cumulative_buckets():
+    seconds = histogram()
+    for value in (0.05, 0.5, 5):
+        seconds.observe(value, stage="llm")
+    assert seconds.render() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="llm",le="0.1"} 1',
+        'test_seconds_bucket{stage="llm",le="1.0"} 2',
+        'test_seconds_bucket{stage="llm",le="+Inf"} 3',
+        'test_seconds_sum{stage="llm"} 5.55',
+        'test_seconds_count{stage="llm"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    seconds = histogram()
+    seconds.observe(0.5, stage='say "hi"\n')
+    assert 'test_seconds_count{stage="say \\"hi\\"\\n"} 1' in seconds.render()
+
+
+def test_span_observes_and_records_timings():
+    seconds = histogram()
+    timings = {}
+    with span("retrieval", timings, histogram=seconds):
+        pass
+    assert set(timings) == {"retrieval"}
+    assert 'test_seconds_count{stage="retrieval"} 1' in seconds.render()
+
+
+def test_timed_function_awaits_coroutines(monkeypatch):
+    seconds = histogram("function_seconds", ("function",))
+    monkeypatch.setattr(metrics, "FUNCTION_LATENCY", seconds)
+
+    @timed_function
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(fetch()) == "done"
+    count, = [line for line in seconds.render() if line.startswith("function_seconds_count")]
+    assert count == 'function_seconds_count{function="fetch"} 1'
+    assert seconds._series[("fetch",)][-2] >= 0.01
+
+
+def test_gauges_have_one_sample_per_value():
+    assert render_gauges("cache", "Cache statistics.", {"hits": 3, "misses": 1}, "stat") == [
+        "# HELP cache Cache statistics.",
+        "# TYPE cache gauge",
+        'cache{stat="hits"} 3',
+        'cache{stat="misses"} 1',
+    ]
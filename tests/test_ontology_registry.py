@@ -0,0 +1,55 @@
+import os
+from ontology_registry import OntologyRegistry, parse_classes_and_properties, extract_prefixes
+
+ONTOLOGY = """@prefix schema: <http://schema.org/> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+
+schema:Person a owl:Class .
+schema:Organization a owl:Class .
+schema:name a owl:ObjectProperty;
+    rdfs:domain [ a owl:Class; owl:unionOf (schema:Person schema:Organization) ] ;
+    rdfs:range xsd:string .
+
+schema:member a owl:ObjectProperty;
+    rdfs:domain [ a owl:Class; owl:unionOf (schema:Organization) ] ;
+    rdfs:range [ a owl:Class; owl:unionOf (schema:Person schema:Organization) ] .
+"""
+
+
+def write(path, content, mtime):
+    path.write_text(content)
+    os.utime(path, (mtime, mtime))
+
+
+def test_classes_properties_and_prefixes_are_parsed():
+    classes, properties = parse_classes_and_properties(ONTOLOGY)
+    assert classes == ["schema:Person", "schema:Organization"]
+    assert properties == {
+        "schema:name": {"domain": ["schema:Person", "schema:Organization"], "range": ["xsd:string"]},
+        "schema:member": {"domain": ["schema:Organization"], "range": ["schema:Person", "schema:Organization"]},
+    }
+    assert extract_prefixes(ONTOLOGY) == "PREFIX schema: <http://schema.org/>\nPREFIX xsd: <http://www.w3.org/2001/XMLSchema#>"
+
+
+def test_snapshot_is_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / "ontology.ttl"
+    write(path, ONTOLOGY, 1000)
+    registry = OntologyRegistry(str(path))
+    snapshot = registry.get()
+    assert registry.refresh() is snapshot
+
+    write(path, ONTOLOGY.replace("schema:member", "schema:founder"), 2000)
+    assert "schema:founder" in registry.refresh().properties
+
+
+def test_touched_but_unchanged_file_is_not_reparsed(tmp_path):
+    path = tmp_path / "ontology.ttl"
+    write(path, ONTOLOGY, 1000)
+    registry = OntologyRegistry(str(path))
+    snapshot = registry.get()
+
+    write(path, ONTOLOGY, 2000)
+    refreshed = registry.refresh()
+    assert refreshed.mtime == 2000
+    # Same parsed objects, only the mtime was updated
+    assert refreshed.properties is snapshot.properties
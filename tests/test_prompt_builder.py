@@ -0,0 +1,50 @@
+import prompt_builder
+from prompt_builder import build_prompt_inputs, compact_entity_matches, compact_query_matches, ontology_selection_text, truncate_text
+from ontology_registry import build_snapshot, text_terms
+from test_ontology_registry import ONTOLOGY
+
+
+def test_truncation_prefers_a_field_boundary():
+    assert truncate_text("name: Jane Doe, researcher; bio: " + "x" * 50, 40) == "name: Jane Doe, researcher ..."
+    assert truncate_text("short", 30) == "short"
+    assert truncate_text(None, 30) is None
+
+
+def test_entity_matches_are_trimmed_and_cut_at_the_budget():
+    matches = [{"EntityID": f"e{i}", "RAG": "a; " * 100} for i in range(5)]
+    compacted = compact_entity_matches(matches, max_rag_chars=40, token_budget=40)
+    assert [match["EntityID"] for match in compacted] == ["e0", "e1"]
+    assert all(len(match["RAG"]) <= 44 for match in compacted)
+    # The caller's matches are left alone
+    assert len(matches[0]["RAG"]) == 300
+
+
+def test_best_match_is_kept_over_budget():
+    assert len(compact_entity_matches([{"RAG": "x" * 4000}], token_budget=10)) == 1
+    assert len(compact_query_matches([{"SPARQL": "x" * 4000}, {"SPARQL": "y"}], token_budget=10)) == 1
+
+
+def test_terms_split_camel_case_and_share_stems():
+    assert {"local", "community"} <= text_terms("LocalCommunity")
+    assert text_terms("invested") & text_terms("investor") == {"invest"}
+
+
+def test_fragment_keeps_properties_related_to_the_question():
+    snapshot = build_snapshot(ONTOLOGY)
+    fragment = snapshot.select_fragment("Who are the members of it?")
+    assert "schema:member" in fragment
+    assert "schema:name" not in fragment
+    assert "Classes: schema:Person, schema:Organization" in fragment
+    # Nothing related: every property is sent
+    assert "schema:name" in snapshot.select_fragment("hello")
+
+
+def test_selection_text_adds_the_types_of_the_matches():
+    matches = [{"RAG": "type: Organization; name: Arweave"}, {"RAG": None}]
+    assert ontology_selection_text("Who funds it?", matches) == "Who funds it? Organization"
+
+
+def test_compaction_can_be_turned_off(monkeypatch):
+    snapshot = build_snapshot(ONTOLOGY)
+    monkeypatch.setattr(prompt_builder, "PROMPT_COMPACTION_ENABLED", False)
+    assert build_prompt_inputs("q", [1], [{"RAG": "x"}], snapshot) == ([1], [{"RAG": "x"}], ONTOLOGY)
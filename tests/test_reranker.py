@@ -0,0 +1,80 @@
+import time
+import asyncio
+import pytest
+import reranker
+from reranker import hybrid_scores, select, tokenize
+from retrieval import SearchHit, ENTITY_COLLECTION
+from keyword_index import KeywordIndex, reciprocal_rank_fusion
+
+
+def hit(name, distance, rag=""):
+    return SearchHit(ENTITY_COLLECTION, name, distance, {"EntityID": f"urn:profile:{name}", "RAG": rag})
+
+
+def names(hits):
+    return [hit.id for hit in hits]
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(reranker, "stats", {"reranked": 0, "over_budget": 0, "below_threshold": 0})
+
+
+def test_tokenize_drops_stopwords_and_single_characters():
+    assert tokenize("Who is working on a DAO in 2024?") == {"working", "dao", "2024"}
+
+
+def test_hybrid_score_blends_similarity_and_term_overlap():
+    hits = [hit("Near", 0.2, "tokenomics"), hit("Far", 0.6, "soil carbon forests")]
+    near, far = hybrid_scores("soil carbon?", hits, lexical_weight=0.3)
+    assert near == pytest.approx(0.7 * 0.9)
+    assert far == pytest.approx(0.7 * 0.7 + 0.3)
+    assert hybrid_scores("soil carbon?", hits, lexical_weight=0) == pytest.approx([0.9, 0.7])
+
+
+def test_exact_name_found_only_by_keyword_search_stays_on_top():
+    rows = [
+        {"EntityID": "urn:profile:0xLuo", "NER": "0xLuo", "RAG": "Builder in regenerative finance", "UAL": "ual:1"},
+        {"EntityID": "urn:org:Arweave", "NER": "Arweave", "RAG": "Permanent storage network", "UAL": "ual:2"},
+        {"EntityID": "urn:org:Gitcoin", "NER": "Gitcoin", "RAG": "Grants for public goods", "UAL": "ual:3"},
+    ]
+    question = "What does 0xLuo build?"
+    vector_hits = [SearchHit(ENTITY_COLLECTION, row["UAL"], distance, row) for row, distance in ((rows[1], 0.3), (rows[2], 0.4))]
+    fused = reciprocal_rank_fusion([vector_hits, KeywordIndex(rows).search(question)], limit=3)
+    assert fused[1].get("EntityID") == "urn:profile:0xLuo" and fused[1].distance is None
+    kept = select(fused, hybrid_scores(question, fused))
+    assert kept[0].get("EntityID") == "urn:profile:0xLuo"
+
+
+def test_select_keeps_the_best_above_the_threshold():
+    hits = [hit("A", 0.1), hit("B", 0.2), hit("C", 0.3)]
+    kept = select(hits, [0.4, 0.9, 0.6], top_n=2, min_score=0.5)
+    assert names(kept) == ["B", "C"]
+    assert [hit.score for hit in kept] == [0.9, 0.6]
+    assert reranker.stats["below_threshold"] == 1
+
+
+def test_rerank_orders_hits_by_hybrid_score(monkeypatch):
+    monkeypatch.setattr(reranker, "RERANKER", "hybrid")
+    hits = [hit("Near", 0.2, "tokenomics"), hit("Far", 0.6, "soil carbon forests")]
+    kept = asyncio.run(reranker.rerank("who works on soil carbon?", hits, top_n=1, min_score=None))
+    assert names(kept) == ["Far"]
+    assert reranker.stats["reranked"] == 1
+
+
+def test_cross_encoder_over_budget_keeps_the_vector_order(monkeypatch):
+    monkeypatch.setattr(reranker, "RERANKER", "cross-encoder")
+    monkeypatch.setattr(reranker, "cross_encoder_scores", lambda question, hits: time.sleep(0.2) or [0.1, 0.9])
+    hits = [hit("A", 0.1), hit("B", 0.2)]
+    kept = asyncio.run(reranker.rerank("q", hits, top_n=1, min_score=None, budget_ms=20))
+    assert names(kept) == ["A"]
+    assert reranker.stats["over_budget"] == 1
+
+
+def test_cross_encoder_scores_within_budget_are_used(monkeypatch):
+    monkeypatch.setattr(reranker, "RERANKER", "cross-encoder")
+    monkeypatch.setattr(reranker, "cross_encoder_scores", lambda question, hits: [0.1, 0.9])
+    hits = [hit("A", 0.1), hit("B", 0.2)]
+    kept = asyncio.run(reranker.rerank("q", hits, top_n=1, min_score=None, budget_ms=1000))
+    assert names(kept) == ["B"]
+    assert reranker.stats["over_budget"] == 0
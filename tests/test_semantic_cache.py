@@ -0,0 +1,61 @@
+import numpy as np
+from semantic_cache import SemanticAnswerCache
+
+MATCHES = [{"EntityID": "urn:profile:JaneDoe"}, {"EntityID": "urn:org:Arweave"}]
+ANSWER = {"Classification": "RAG", "Response": {"Text": "Jane Doe researches soil carbon."}}
+
+
+def question(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_similar_question_with_the_same_matches_hits():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    assert cache.lookup(question(1, 0.05, 0), MATCHES) == ANSWER
+    assert cache.stats()["hits"] == 1
+
+
+def test_dissimilar_question_misses():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    assert cache.lookup(question(0, 1, 0), MATCHES) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_different_entity_matches_miss():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    assert cache.lookup(question(1, 0, 0), list(reversed(MATCHES))) is None
+    assert cache.lookup(question(1, 0, 0), MATCHES[:1]) is None
+
+
+def test_expired_entries_are_dropped():
+    cache = SemanticAnswerCache(ttl=0)
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    assert cache.lookup(question(1, 0, 0), MATCHES) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_oldest_entry_is_evicted_when_full():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store(question(1, 0, 0), MATCHES, {"n": 1})
+    cache.store(question(0, 1, 0), MATCHES, {"n": 2})
+    cache.store(question(0, 0, 1), MATCHES, {"n": 3})
+    assert cache.lookup(question(1, 0, 0), MATCHES) is None
+    assert cache.lookup(question(0, 0, 1), MATCHES) == {"n": 3}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_zero_entries_stores_nothing():
+    cache = SemanticAnswerCache(max_entries=0)
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    assert cache.lookup(question(1, 0, 0), MATCHES) is None
+
+
+def test_clear_drops_every_entry():
+    cache = SemanticAnswerCache()
+    cache.store(question(1, 0, 0), MATCHES, ANSWER)
+    cache.clear()
+    assert cache.lookup(question(1, 0, 0), MATCHES) is None
+    assert cache.stats()["entries"] == cache.stats()["bytes"] == 0
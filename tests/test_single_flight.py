@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_case_and_spacing():
+    assert request_key("query", "Who is  Jane?", []) == request_key("query", "who is jane?", [])
+    assert request_key("query", "who is jane?", []) != request_key("twitter", "who is jane?", [])
+    assert request_key("query", "who is jane?", []) != request_key("query", "who is jane?", [{"role": "user"}])
+
+
+def test_concurrent_callers_share_one_run():
+    flights = SingleFlight(enabled=True)
+    calls = []
+
+    async def answer(question):
+        calls.append(question)
+        await asyncio.sleep(0.01)
+        return question.upper()
+
+    async def main():
+        return await asyncio.gather(*[flights.run("k", answer, "q") for _ in range(5)])
+
+    assert asyncio.run(main()) == ["Q"] * 5
+    assert calls == ["q"]
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 4}
+
+
+def test_different_keys_and_later_calls_run_separately():
+    flights = SingleFlight(enabled=True)
+    calls = []
+
+    async def answer(question):
+        calls.append(question)
+        await asyncio.sleep(0)
+        return question
+
+    async def main():
+        await asyncio.gather(flights.run("a", answer, "a"), flights.run("b", answer, "b"))
+        await flights.run("a", answer, "a")
+
+    asyncio.run(main())
+    assert sorted(calls) == ["a", "a", "b"]
+
+
+def test_callers_share_the_exception():
+    flights = SingleFlight(enabled=True)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(flights.run("k", fail), flights.run("k", fail), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert flights.stats()["started"] == 1
+
+
+def test_run_continues_while_another_caller_waits():
+    flights = SingleFlight(enabled=True)
+
+    async def answer():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flights.run("k", answer))
+        second = asyncio.ensure_future(flights.run("k", answer))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_run_is_cancelled_when_its_last_caller_goes_away():
+    flights = SingleFlight(enabled=True)
+    cancelled = []
+
+    async def answer():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        caller = asyncio.ensure_future(flights.run("k", answer))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+    assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,80 @@
+import pytest
+import sparql_cache
+from sparql_cache import SPARQLResultCache, normalize_query
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sparql_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_normalize_query_sorts_and_deduplicates_prefixes():
+    a = "PREFIX schema: <http://schema.org/>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\nSELECT ?s WHERE { ?s a schema:Person . }"
+    b = ("PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\nPREFIX schema: <http://schema.org/>\n"
+         "PREFIX schema: <http://schema.org/>\nSELECT ?s\n  WHERE {\n    ?s a schema:Person.\n}")
+    assert normalize_query(a) == normalize_query(b)
+    assert normalize_query(a).splitlines()[:2] == [
+        "PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>",
+        "PREFIX schema: <http://schema.org/>",
+    ]
+
+
+def test_normalize_query_keeps_whitespace_inside_literals():
+    a = 'SELECT ?s WHERE { ?s schema:name "Jane  Doe" }'
+    b = 'SELECT ?s WHERE { ?s schema:name "Jane Doe" }'
+    assert normalize_query(a) != normalize_query(b)
+    assert '"Jane  Doe"' in normalize_query(a)
+
+
+def test_equivalent_queries_share_an_entry():
+    cache = SPARQLResultCache()
+    cache.put("SELECT ?s WHERE { ?s ?p ?o }", [{"s": "1"}])
+    assert cache.get("SELECT ?s\nWHERE {?s ?p ?o}") == [{"s": "1"}]
+    assert cache.stats()["hits"] == 1
+
+
+def test_results_expire_after_ttl(clock):
+    cache = SPARQLResultCache(ttl=60)
+    cache.put("q", [{"s": "1"}])
+    clock[0] += 59
+    assert cache.get("q") == [{"s": "1"}]
+    clock[0] += 2
+    assert cache.get("q") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_empty_results_use_the_short_ttl(clock):
+    cache = SPARQLResultCache(ttl=600, empty_ttl=30)
+    cache.put("empty", [])
+    cache.put("full", [{"s": "1"}])
+    clock[0] += 31
+    assert cache.get("empty") is None
+    assert cache.get("full") == [{"s": "1"}]
+
+
+def test_empty_results_are_not_cached_with_zero_empty_ttl():
+    cache = SPARQLResultCache(empty_ttl=0)
+    cache.put("q", [])
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    result = [{"s": "x" * 40}]
+    size = len(sparql_cache.json.dumps(result))
+    cache = SPARQLResultCache(max_bytes=2 * size)
+    cache.put("q1", result)
+    cache.put("q2", result)
+    assert cache.get("q1") == result
+    cache.put("q3", result)
+    assert cache.get("q2") is None
+    assert cache.get("q1") == result
+    assert cache.get("q3") == result
+    assert cache.stats()["evictions"] == 1
+
+
+def test_result_larger_than_the_cache_is_not_stored():
+    cache = SPARQLResultCache(max_bytes=10)
+    cache.put("q", [{"s": "x" * 40}])
+    assert cache.get("q") is None
@@ -0,0 +1,40 @@
+import json
+from streaming import JSONStringFieldStreamer, format_sse
+
+DOCUMENT = json.dumps({
+    "Classification": "RAG",
+    "Response": "Jane \"JD\" Doe\nworks on 😀 café",
+    "SPARQL": "SELECT ?s",
+}, ensure_ascii=True)
+
+
+def stream(document, chunk_size):
+    streamer = JSONStringFieldStreamer("Response")
+    parts = [streamer.feed(document[i:i + chunk_size]) for i in range(0, len(document), chunk_size)]
+    return "".join(parts), streamer
+
+
+def test_field_is_unescaped_whatever_the_chunk_boundaries():
+    # Chunks of one character split every escape, including the surrogate pair
+    for chunk_size in (1, 2, 5, 7, len(DOCUMENT)):
+        text, streamer = stream(DOCUMENT, chunk_size)
+        assert text == "Jane \"JD\" Doe\nworks on 😀 café"
+        assert streamer.done
+
+
+def test_text_arrives_as_it_is_generated():
+    streamer = JSONStringFieldStreamer("Response")
+    assert streamer.feed('{"Classification": "RAG", "Resp') == ""
+    assert streamer.feed('onse": "Hel') == "Hel"
+    assert streamer.feed('lo", "SPARQL": "x"}') == "lo"
+    assert streamer.feed('more') == ""
+
+
+def test_missing_field_yields_nothing():
+    text, streamer = stream('{"Classification": "Error"}', 3)
+    assert text == ""
+    assert not streamer.done
+
+
+def test_sse_message_carries_the_event_and_json_data():
+    assert format_sse("rag_delta", {"text": "a\nb"}) == 'event: rag_delta\ndata: {"text": "a\\nb"}\n\n'